@@ -0,0 +1,13 @@
+''' What the tests of this directory share '''
+import os
+
+import pytest
+
+GAME_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.fixture(autouse=True)
+def game_directory(monkeypatch):
+        ''' run every test from the game directory, which icon paths are
+        relative to
+        '''
+        monkeypatch.chdir(GAME_DIRECTORY)
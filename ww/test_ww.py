@@ -0,0 +1,159 @@
+''' Tests for ww, run with python -m pytest '''
+import random
+import sys
+
+import pytest
+
+from ww import *
+
+TICKS = 150
+SIZE = 20
+
+# the monsters put on the boards, in turn: (class, icon)
+MONSTERS = [(Monster, "icons/Monsters/white_monster.png"),
+            (Shy_Monster, "icons/Monsters/purple_monster.png"),
+            (Stalker_Monster, "icons/Monsters/yellow_monster.png"),
+            (Fire_Monster, "icons/Monsters/red_monster.png"),
+            (Ice_Monster, "icons/Monsters/dark_blue_monster.png"),
+            (Earth_Monster, "icons/Monsters/green_monster.png")]
+
+# the actors a row is made of, by letter
+ACTORS = {"B": (Box, "icons/Boxes/black_box.png"),
+          "I": (Ice_Box, "icons/Boxes/ice_box.png"),
+          "F": (Fire_Wall, "icons/Boxes/flame_box.png"),
+          "M": (Monster, "icons/Monsters/white_monster.png")}
+
+def row(layout):
+        ''' a stage three cells high with a player at the left of its middle
+        row and an actor for each letter of layout (see ACTORS) to its right,
+        return (stage, player, the actors of the row)
+        '''
+        stage = Stage(len(layout) + 2, 3, 24, None, headless=True)
+        player = KeyboardPlayer("icons/Players/player1.png", stage, 0, 1, 1)
+        stage.set_player(player, None)
+        actors = []
+        for (x, letter) in enumerate(layout, 1):
+                (cls, icon) = ACTORS[letter]
+                actors.append(cls(icon, stage, x, 1, 50))
+                stage.add_actor(actors[-1])
+        return (stage, player, actors)
+
+def positions(actors):
+        return [a.get_position() for a in actors]
+
+def test_push_row_longer_than_recursion_limit():
+        (stage, player, boxes) = row("B" * (sys.getrecursionlimit() + 100))
+        assert player.move(player, 1, 0)
+        assert player.get_position() == (1, 1)
+        assert positions(boxes) == [(x, 1) for x in range(2, len(boxes) + 2)]
+
+def test_push_row_into_edge():
+        (stage, player, boxes) = row("BBB")
+        boxes.append(Box("icons/Boxes/black_box.png", stage, 4, 1))
+        stage.add_actor(boxes[-1])
+        assert not player.move(player, 1, 0)
+        assert positions([player] + boxes) == [(x, 1) for x in range(5)]
+
+def test_push_row_into_fire_wall():
+        (stage, player, actors) = row("BBBF")
+        assert not player.move(player, 1, 0)
+        assert positions([player] + actors) == [(x, 1) for x in range(5)]
+        #the box pushed into the fire turns into fire
+        assert actors[2].is_dead()
+        assert [type(a) for a in stage.get_actors_in(3, 1, 1, 1)] == \
+               [Box, Fire_Wall]
+
+def test_ice_box_puts_out_fire_wall():
+        (stage, player, actors) = row("BBIF")
+        assert player.move(player, 1, 0)
+        assert positions([player] + actors[:3]) == \
+               [(x, 1) for x in range(1, 5)]
+        assert actors[3].is_dead()
+
+def test_push_row_into_monster():
+        (stage, player, actors) = row("BBBM")
+        assert not player.move(player, 1, 0)
+        assert positions([player] + actors) == [(x, 1) for x in range(5)]
+        assert not actors[3].is_frozen()
+
+def test_push_ice_box_into_monster():
+        (stage, player, actors) = row("BBIM")
+        assert not player.move(player, 1, 0)
+        assert positions([player] + actors) == [(x, 1) for x in range(5)]
+        #the monster sticks to the ice box instead
+        assert actors[3].is_frozen()
+        assert actors[2].get_frozen_monsters() == [actors[3]]
+
+def test_push_releases_frozen_monsters():
+        (stage, player, actors) = row("BIB")
+        ice = actors[1]
+        monsters = [Monster("icons/Monsters/white_monster.png", stage,
+                            2, y, 50) for y in (0, 2)]
+        for monster in monsters:
+                stage.add_actor(monster)
+                ice.add_to_frozen(monster)
+                monster.set_frozen(True)
+        assert player.move(player, 1, 0)
+        assert positions([player] + actors) == [(x, 1) for x in range(1, 5)]
+        assert ice.get_frozen_monsters() == []
+        assert not any(monster.is_frozen() for monster in monsters)
+
+def mixed_stage(seed):
+        ''' a SIZE x SIZE stage with two players, boxes, ice boxes, fire
+        walls and monsters of every kind, with delays either side of
+        WAIT_DELAY
+        '''
+        rng = random.Random(seed)
+        stage = Stage(SIZE, SIZE, 24, None, headless=True)
+        stage.set_player(KeyboardPlayer("icons/Players/player1.png", stage,
+                                        0, 0, 1),
+                         KeyboardPlayer("icons/Players/player2.png", stage,
+                                        SIZE - 1, SIZE - 1, 2))
+        cells = rng.sample(range(1, SIZE * SIZE - 1), SIZE * SIZE // 3)
+        for (n, cell) in enumerate(cells):
+                (x, y) = (cell % SIZE, cell // SIZE)
+                if n % 4 != 0:
+                        letter = rng.choice("BBBBBBIF")
+                        (cls, icon) = ACTORS[letter]
+                        stage.add_actor(cls(icon, stage, x, y))
+                        continue
+                (cls, icon) = MONSTERS[n // 4 % len(MONSTERS)]
+                delay = rng.randrange(1, 2 * WAIT_DELAY)
+                if cls is Shy_Monster:
+                        monster = cls(icon, "icons/Boxes/monster_disguise.png",
+                                      stage, x, y, delay)
+                else:
+                        monster = cls(icon, stage, x, y, delay)
+                monster.set_direction(rng.choice((-1, 0, 1)),
+                                      rng.choice((-1, 1)))
+                stage.add_actor(monster)
+        return stage
+
+def trace(seed):
+        ''' return what every actor of a mixed stage is after each of TICKS
+        steps, the players pressing random keys (or none)
+        '''
+        rng = random.Random(seed)
+        stage = mixed_stage(seed)
+        result = []
+        for tick in range(TICKS):
+                for keys in (PLAYER_KEYS[1], PLAYER_KEYS[2]):
+                        if rng.random() < 0.3:
+                                stage.player_event(rng.choice(keys))
+                stage.step()
+                result.append([(type(a).__name__, a.get_id(),
+                                a.get_position(), Actor.is_dead(a),
+                                a.get_delay_count())
+                               + ((a.get_direction(), a.is_frozen())
+                                  if isinstance(a, Monster) else ())
+                               for a in stage.get_actors()])
+        return result
+
+@pytest.mark.parametrize("seed", range(30))
+def test_waiting_actors_step_like_every_actor(seed, monkeypatch):
+        with monkeypatch.context() as patch:
+                #every actor steps every tick
+                patch.setattr(Stage, "_waits", lambda self, actor: False)
+                patch.setattr(Stage, "_sleeps", lambda self, actor: False)
+                expected = trace(seed)
+        assert trace(seed) == expected
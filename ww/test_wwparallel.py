@@ -0,0 +1,25 @@
+''' Tests for wwparallel, run with python -m pytest '''
+import pytest
+
+pytest.importorskip("numpy")
+from wwparallel import Parallel_Stage
+from test_wwvector import board, state
+
+TICKS = 60
+
+@pytest.mark.parametrize("workers", [2, 3])
+@pytest.mark.parametrize("seed", range(6))
+def test_parallel_steps_like_stage(seed, workers):
+        #crowded, so many movers are near a band's edge and go to the merge
+        expected = board(seed, 40, monster_density=20)
+        stage = board(seed, 40, monster_density=20)
+        engine = Parallel_Stage(stage, workers)
+        try:
+                for tick in range(TICKS):
+                        expected.step()
+                        engine.step()
+                        if tick % 7 == 0 or tick == TICKS - 1:
+                                engine.sync()
+                                assert state(stage) == state(expected), tick
+        finally:
+                engine.close()
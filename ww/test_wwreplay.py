@@ -0,0 +1,83 @@
+''' Tests for wwreplay, run with python -m pytest '''
+import random
+
+import pytest
+
+from ww import *
+import wwsnapshot
+from wwreplay import Recorder, Replay
+
+TICKS = 60
+SIZE = 25
+
+# the monsters put on the boards, in turn: (class, icon)
+MONSTERS = [(Monster, "icons/Monsters/white_monster.png"),
+            (Shy_Monster, "icons/Monsters/purple_monster.png"),
+            (Stalker_Monster, "icons/Monsters/yellow_monster.png"),
+            (Fire_Monster, "icons/Monsters/red_monster.png"),
+            (Ice_Monster, "icons/Monsters/dark_blue_monster.png"),
+            (Earth_Monster, "icons/Monsters/green_monster.png")]
+
+def crowded_stage(seed):
+        ''' a SIZE x SIZE stage with players in opposite corners, a fifth of
+        the cells holding boxes and enough monsters of every kind (with
+        random delays and directions) that players die
+        '''
+        rng = random.Random(seed)
+        stage = Stage(SIZE, SIZE, 24, None, headless=True)
+        stage.set_player(KeyboardPlayer("icons/Players/player1.png", stage,
+                                        0, 0, 1),
+                         KeyboardPlayer("icons/Players/player2.png", stage,
+                                        SIZE - 1, SIZE - 1, 2))
+        cells = rng.sample(range(1, SIZE * SIZE - 1), SIZE * SIZE * 28 // 100)
+        monsters = SIZE * SIZE * 8 // 100
+        for n, cell in enumerate(cells):
+                (x, y) = (cell % SIZE, cell // SIZE)
+                if n >= monsters:
+                        stage.add_actor(Box("icons/Boxes/black_box.png",
+                                            stage, x, y))
+                        continue
+                (cls, icon) = MONSTERS[n % len(MONSTERS)]
+                if cls is Shy_Monster:
+                        monster = cls(icon, "icons/Boxes/monster_disguise.png",
+                                      stage, x, y, rng.randrange(1, 6))
+                else:
+                        monster = cls(icon, stage, x, y, rng.randrange(1, 6))
+                monster.set_direction(rng.choice((-1, 1)),
+                                      rng.choice((-1, 1)))
+                stage.add_actor(monster)
+        return stage
+
+def record(seed):
+        ''' return (the replay log, a snapshot of the stage at the end) of a
+        game of TICKS steps on a crowded stage, both players pressing random
+        keys
+        '''
+        rng = random.Random(seed)
+        stage = crowded_stage(seed)
+        recorder = Recorder(stage, seed)
+        for tick in range(TICKS):
+                for keys in (PLAYER_KEYS[1], PLAYER_KEYS[2]):
+                        if rng.random() < 0.5:
+                                recorder.player_event(rng.choice(keys))
+                recorder.step()
+        return (recorder.to_bytes(), wwsnapshot.dump(stage))
+
+@pytest.mark.parametrize("seed", range(40))
+def test_replay_matches_recorded_game(seed):
+        (log, final) = record(seed)
+        assert wwsnapshot.dump(Replay(log, TICKS + 1).play()) == final
+
+@pytest.mark.parametrize("seed", range(40))
+def test_seeking_matches_full_replay(seed):
+        (log, final) = record(seed)
+        #a snapshot after every step of the full replay
+        full = Replay(log, 1)
+        assert wwsnapshot.dump(full.play()) == final
+        #every other step, so every odd step is sought by stepping once
+        #from a snapshot
+        replay = Replay(log, 2)
+        replay.play()
+        for tick in range(1, TICKS, 2):
+                assert wwsnapshot.dump(replay.stage_at(tick)) == \
+                       wwsnapshot.dump(full.stage_at(tick)), tick
@@ -0,0 +1,52 @@
+''' Tests for wwsnapshot, run with python -m pytest '''
+from ww import *
+import wwsnapshot
+
+def state(stage):
+        ''' what stage holds, without asking any actor whether it is dead '''
+        return [(type(a).__name__, a.get_id(), a.get_position(),
+                 Actor.is_dead(a)) for a in stage.get_actors()]
+
+def boxed_in_stage():
+        ''' a stage with a Fire_Monster boxed into a corner, which dies (and
+        turns into a Fire_Wall) when next stepped
+        '''
+        stage = Stage(8, 8, 24, None, headless=True)
+        stage.add_actor(Fire_Monster("icons/Monsters/red_monster.png", stage,
+                                     0, 0, 1))
+        for (x, y) in [(1, 0), (0, 1), (1, 1)]:
+                stage.add_actor(Box("icons/Boxes/black_box.png", stage, x, y))
+        stage.add_player(KeyboardPlayer("icons/Players/player1.png", stage,
+                                        5, 5, 1))
+        return stage
+
+def test_dump_leaves_stage_unchanged():
+        stage = boxed_in_stage()
+        before = state(stage)
+        next_id = stage.get_next_id()
+        wwsnapshot.dump(stage)
+        assert state(stage) == before
+        assert stage.get_next_id() == next_id
+
+def test_load_steps_like_original():
+        stage = boxed_in_stage()
+        copy = wwsnapshot.load(wwsnapshot.dump(stage))
+        assert state(copy) == state(stage)
+        for tick in range(10):
+                stage.step()
+                copy.step()
+                assert wwsnapshot.dump(copy) == wwsnapshot.dump(stage), tick
+        assert "Fire_Wall" in [name for (name, i, cell, dead)
+                               in state(stage)]
+
+def test_load_keeps_counts():
+        stage = boxed_in_stage()
+        stage.step() #the Fire_Monster evolves
+        player = stage.get_player(1)
+        player.kill()
+        stage.remove_player(player)
+        assert (stage.get_evolution_count(),
+                stage.get_player_death_count()) == (1, 1)
+        copy = wwsnapshot.load(wwsnapshot.dump(stage))
+        assert (copy.get_evolution_count(),
+                copy.get_player_death_count()) == (1, 1)
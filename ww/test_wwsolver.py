@@ -0,0 +1,83 @@
+''' Tests for wwsolver, run with python -m pytest '''
+import random
+
+import pytest
+
+from ww import *
+import wwsnapshot
+from wwsolver import Solver, MOVES, WAIT
+
+DEPTH = 6
+
+def walled_stage():
+        ''' a 70 x 40 stage cut by a row of boxes with a gap at its right
+        end, the player above it and a Stalker_Monster below, so the way
+        around the row is further than the solver's margin
+        '''
+        stage = Stage(70, 40, 24, None, headless=True)
+        for x in range(69):
+                stage.add_actor(Box("icons/Boxes/black_box.png", stage, x, 15))
+        stage.set_player(KeyboardPlayer("icons/Players/player1.png", stage,
+                                        22, 10, 1), None)
+        stage.add_actor(Stalker_Monster("icons/Monsters/yellow_monster.png",
+                                        stage, 28, 20, 1))
+        return stage
+
+def scattered_stage(seed):
+        ''' a 60 x 60 stage with a tenth of the cells holding boxes, the
+        player and a Stalker_Monster and a Monster near the middle
+        '''
+        rng = random.Random(seed)
+        stage = Stage(60, 60, 24, None, headless=True)
+        stage.set_player(KeyboardPlayer("icons/Players/player1.png", stage,
+                                        30, 30, 1), None)
+        stage.add_actor(Stalker_Monster("icons/Monsters/yellow_monster.png",
+                                        stage, 30 + rng.randrange(3, 8),
+                                        30 + rng.randrange(3, 8),
+                                        rng.randrange(1, 4)))
+        stage.add_actor(Monster("icons/Monsters/white_monster.png", stage,
+                                30 - rng.randrange(3, 8), 30, 1))
+        for cell in rng.sample(range(60 * 60), 360):
+                (x, y) = (cell % 60, cell // 60)
+                if stage.get_actor(x, y) is None:
+                        stage.add_actor(Box("icons/Boxes/black_box.png",
+                                            stage, x, y))
+        return stage
+
+def positions(stage, ids):
+        ''' the cell of each actor of ids, None once it is gone '''
+        cells = []
+        for actor_id in ids:
+                actor = stage.get_actor_by_id(actor_id)
+                cells.append(None if actor is None else actor.get_position())
+        return cells
+
+def assert_window_steps_like_stage(stage, moves):
+        ''' step the solver's window around the player and every monster, and
+        the whole stage, by moves, and check the player and monsters go the
+        same way in both
+        '''
+        solver = Solver(stage, max_depth=DEPTH)
+        monsters = [a for a in stage.get_actors() if isinstance(a, Monster)]
+        ids = [stage.get_player(1).get_id()] + [m.get_id() for m in monsters]
+        for monster in monsters:
+                window = solver._window(monster)
+                whole = wwsnapshot.load(wwsnapshot.dump(stage))
+                solver._make_remote(whole, whole.get_player(1))
+                for (step, code) in enumerate(moves):
+                        for copy in (window, whole):
+                                player = copy.get_player(1)
+                                if player is not None:
+                                        player.handle_event(code)
+                                copy.step()
+                        assert positions(window, ids) == \
+                               positions(whole, ids), (monster, step)
+
+def test_window_sees_boxes_a_stalker_goes_around():
+        assert_window_steps_like_stage(walled_stage(), [WAIT] * DEPTH)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_window_steps_like_stage(seed):
+        rng = random.Random(seed)
+        moves = [rng.choice(MOVES) for step in range(DEPTH)]
+        assert_window_steps_like_stage(scattered_stage(seed), moves)
@@ -0,0 +1,80 @@
+''' Tests for wwvector, run with python -m pytest '''
+import random
+
+import pytest
+
+from ww import *
+
+pytest.importorskip("numpy")
+from wwvector import Vector_Stage
+
+TICKS = 120
+
+# the boxes put on the boards: (class, icon, how many in a hundred cells)
+BOXES = [(Box, "icons/Boxes/black_box.png", 25),
+         (Wall, "icons/Boxes/immovable_box.png", 2),
+         (Ice_Box, "icons/Boxes/ice_box.png", 2),
+         (Fire_Wall, "icons/Boxes/flame_box.png", 1)]
+
+def board(seed, size=30, monster_density=7):
+        ''' a size x size headless stage with two idle players, boxes of
+        every kind and monster_density monsters in a hundred cells, each
+        with a random delay and direction
+        '''
+        rng = random.Random(seed)
+        stage = Stage(size, size, 24, None, headless=True)
+        stage.set_player(KeyboardPlayer("icons/Players/player1.png", stage,
+                                        0, 0, 1),
+                         KeyboardPlayer("icons/Players/player2.png", stage,
+                                        size // 2, size // 2, 2))
+        kinds = [(Monster, "icons/Monsters/white_monster.png",
+                  monster_density)] + BOXES
+        items = []
+        for (cls, icon, density) in kinds:
+                items.extend([(cls, icon)] * (size * size * density // 100))
+        rng.shuffle(items)
+        cells = [(x, y) for x in range(size) for y in range(size)
+                 if (x, y) not in ((0, 0), (size // 2, size // 2))]
+        for ((cls, icon), (x, y)) in zip(items, rng.sample(cells, len(items))):
+                if cls is Monster:
+                        actor = Monster(icon, stage, x, y, rng.randrange(1, 6))
+                        actor.set_direction(rng.choice((-1, 1)),
+                                            rng.choice((-1, 1)))
+                else:
+                        actor = cls(icon, stage, x, y)
+                stage.add_actor(actor)
+        return stage
+
+def state(stage):
+        ''' every actor of stage with what a step can change about it, and
+        the numbers of the players still on it
+        '''
+        actors = stage.get_actors()
+        ids = dict((id(a), a.get_id()) for a in actors)
+        result = []
+        for a in actors:
+                item = (type(a).__name__, a.get_id(), a.get_position(),
+                        Actor.is_dead(a))
+                if isinstance(a, Monster):
+                        item += (a.get_direction(), a.is_frozen(),
+                                 a.get_delay_count())
+                if isinstance(a, Ice_Box):
+                        item += (sorted(ids.get(id(m), -1)
+                                        for m in a.get_frozen_monsters()),)
+                result.append(item)
+        return (result, [p.get_player_number() for p in stage.get_players()])
+
+@pytest.mark.parametrize("seed", range(20))
+def test_vector_steps_like_stage(seed):
+        expected = board(seed)
+        stage = board(seed)
+        engine = Vector_Stage(stage)
+        for tick in range(TICKS):
+                expected.step()
+                engine.step()
+                if tick % 7 == 0 or tick == TICKS - 1:
+                        engine.sync()
+                        assert state(stage) == state(expected), tick
+        #some monsters burned on the fire walls, so removals were compared
+        assert engine.get_monster_count() < len(
+                [a for a in board(seed).get_actors() if type(a) is Monster])
@@ -1,38 +1,201 @@
+import heapq
+import os
 import pygame
 import random
 
+# the eight directions an actor can move in
+DIRECTIONS = [(-1,-1), (0,-1), (1,-1), (-1,0), (1,0), (-1,1), (0,1), (1,1)]
+
+# the side of the square chunks a stage keeps its free counts in
+CHUNK_BITS = 4
+CHUNK_SIZE = 1 << CHUNK_BITS
+_CHUNK_MASK = CHUNK_SIZE - 1
+_CHUNK_AREA = CHUNK_SIZE * CHUNK_SIZE
+# offsets in a chunk's counts of the 3x3 square around a cell
+_CHUNK_AROUND = [j*CHUNK_SIZE + i for j in (-1,0,1) for i in (-1,0,1)]
+_CHUNK_SPAN = CHUNK_SIZE + 1 #the furthest of those from the middle
+
+#monsters with a delay this long or longer wait between moves instead of
+#stepping every step, shorter delays are cheaper to step through
+WAIT_DELAY = 6
+
+# the movement keys of player 1 and player 2
+PLAYER_KEYS = {1: [pygame.K_w, pygame.K_e, pygame.K_r, pygame.K_c,
+                   pygame.K_s, pygame.K_d, pygame.K_z, pygame.K_x],
+               2: [pygame.K_y, pygame.K_u, pygame.K_i, pygame.K_h,
+                   pygame.K_j, pygame.K_b, pygame.K_n, pygame.K_m]}
+
+# icon file -> surface, shared by every actor using that icon
+_icon_cache = {}
+
+def load_icon(icon_file):
+        ''' return the surface for icon_file, decoding it only the first time
+        it is asked for. Once a display exists, surfaces are converted to its
+        pixel format (keeping per pixel alpha where the image has it) so they
+        blit quickly.
+        '''
+        icon = _icon_cache.get(icon_file)
+        if icon is None:
+                icon = pygame.image.load(icon_file)
+                if pygame.display.get_surface() is not None:
+                        if icon.get_flags() & pygame.SRCALPHA:
+                                icon = icon.convert_alpha()
+                        else:
+                                icon = icon.convert()
+                _icon_cache[icon_file] = icon
+        return icon
+
+def preload_icons(directory="icons"):
+        ''' load every image under directory into the icon cache, so nothing
+        is decoded while the game is running
+        '''
+        for root, dirs, files in os.walk(directory):
+                for name in files:
+                        if name.lower().endswith((".png", ".jpg", ".gif")):
+                                load_icon(os.path.join(root, name).replace(
+                                        os.sep, "/"))
+
+def clear_icon_cache():
+        _icon_cache.clear()
+
+# where the icons of actors are, packed into a Sprite_Atlas by default
+ATLAS_DIRECTORIES = ["icons/Boxes", "icons/Monsters", "icons/Players"]
+
+class Sprite_Atlas:
+        ''' Actor icons packed side by side into one surface, so a stage can
+        draw a whole frame of actors in one Surface.blits call, each blitting
+        the area of the atlas holding its icon. Make one after the display
+        is set up, so the atlas is converted to its pixel format.
+        '''
+
+        def __init__(self, icon_files=None):
+                if icon_files is None:
+                        icon_files = []
+                        for directory in ATLAS_DIRECTORIES:
+                                icon_files.extend(
+                                        directory + "/" + name for name in
+                                        sorted(os.listdir(directory))
+                                        if name.lower().endswith(
+                                                (".png", ".jpg", ".gif")))
+                icons = [load_icon(icon_file) for icon_file in icon_files]
+                width = max([icon.get_width() for icon in icons] or [1])
+                height = max([icon.get_height() for icon in icons] or [1])
+                columns = max(int(len(icons) ** 0.5), 1)
+                rows = max(-(-len(icons) // columns), 1)
+                self._surface = pygame.Surface((columns*width, rows*height),
+                                               pygame.SRCALPHA)
+                if pygame.display.get_surface() is not None:
+                        self._surface = self._surface.convert_alpha()
+                #icon surface -> the area of the atlas holding it
+                self._areas = {}
+                for n, icon in enumerate(icons):
+                        area = pygame.Rect((n % columns) * width,
+                                           (n // columns) * height,
+                                           icon.get_width(), icon.get_height())
+                        #added onto the transparent atlas, a copy of the
+                        #icon's pixels and alpha
+                        self._surface.blit(icon, area,
+                                           special_flags=pygame.BLEND_RGBA_ADD)
+                        self._areas[icon] = area
+
+        def get_surface(self):
+                return self._surface
+
+        def get_areas(self):
+                ''' return a dict from every icon surface in self to the area
+                of self's surface holding it
+                '''
+                return self._areas
+
 class Actor:
         '''Something occupying a space on the stage, it has an icon, position,
         delay, and can die(be removed from the stage
         '''
+        __slots__ = ('_icon_file', '_icon', '_stage', '_x', '_y', '_delay',
+                     '_delay_count', '_is_dead', '_id')
+
         def __init__(self, icon_file, stage, x, y, delay=5):
-                self._icon=pygame.image.load(icon_file) # the image to display
-                self.set_position(x, y) # self's location on the stage
+                self._icon_file=icon_file
+                self._icon=stage.load_icon(icon_file) # the image to display
                 self._stage=stage # the stage that self is on
+                (self._x, self._y) = (x, y) # self's location on the stage
                 self._delay=delay # the Actors 'speed' relative to other actors
                 self._delay_count=0# used by delay to alter the actor's speed
                 self._is_dead=False#Controls whether the actor is on the stage
+                self._id=None #given by the stage when self is added to it
         
         def set_position(self, x, y):
+                (old_x, old_y) = (self._x, self._y)
                 (self._x, self._y) = (x, y)
+                #keep the stage's cell index in step with our position
+                self._stage.move_actor(self, old_x, old_y)
 
         def get_position(self):
                 return (self._x, self._y)
 
+        def get_id(self):
+                return self._id
+
+        def set_id(self, actor_id):
+                self._id = actor_id
+
         def get_icon(self):
                 return self._icon
+
+        def get_icon_file(self):
+                return self._icon_file
+
+        def is_animated(self):
+                ''' return whether self's icon can change while self stays
+                still, the stage then redraws self on every draw
+                '''
+                return False
         
         def infront_moveable(self, new_x, new_y, dx, dy):
                 '''After asking the Actor at new_x and new_y (with respect to
                 self) to move dx, dy, return whether the Actor infront moved
-                and move accordingly
+                and move accordingly.
+                A line of pushable actors (boxes) is walked once, up to the
+                first empty cell or other actor, which is asked to move as
+                usual. If that works the whole line moves, furthest first.
                 '''
-                infront = self._stage.get_actor(new_x, new_y)
-                if infront != None:
-                        if not infront.move(self, dx, dy):
-                                return False
+                pushed = [] #the line of boxes being pushed, nearest first
+                pusher = self
+                (x, y) = (new_x, new_y)
+                moved = True
+                while True:
+                        infront = self._stage.get_actor(x, y)
+                        if infront == None:
+                                break
+                        if not infront.is_pushable():
+                                moved = infront.move(pusher, dx, dy)
+                                break
+                        if not self._stage.is_in_bounds(x+dx, y+dy):
+                                moved = False
+                                break
+                        pushed.append(infront)
+                        pusher = infront
+                        (x, y) = (x+dx, y+dy)
+
+                if pushed:
+                        profiler = self._stage.get_profiler()
+                        if profiler is not None:
+                                profiler.count_push(len(pushed))
+                if not moved:
+                        return False
+                for i in range(len(pushed)-1, -1, -1):
+                        if i > 0:
+                                pushed[i].pushed(pushed[i-1], dx, dy)
+                        else:
+                                pushed[i].pushed(self, dx, dy)
                 return True
 
+        def is_pushable(self):
+                ''' return whether self is moved by infront_moveable as part
+                of a line of pushed actors, rather than asked to move
+                '''
+                return False
+
         def move(self, other, dx, dy):
                 ''' other is telling us to move in direction (dx, dy), in this
                 case, we just move. (dx,dy) is in {(1,1), (1,0), (1,-1), (0,1),
@@ -50,6 +213,21 @@ class Actor:
                 self._delay_count=(self._delay_count+1)% self._delay
                 return self._delay_count==0
 
+        def get_delay(self):
+                return self._delay
+
+        def get_delay_count(self):
+                #the stage counts for self while self waits
+                count = self._stage.waiting_delay_count(self)
+                if count is None:
+                        return self._delay_count
+                return count
+
+        def set_delay_count(self, delay_count):
+                #a waiting actor's count is the stage's to keep until woken
+                self._stage.wake(self)
+                self._delay_count = delay_count
+
         def step(self):
                 ''' self takes a single step in the animation of the game.
                 self can ask the stage to help as well as ask other Actors
@@ -62,7 +240,9 @@ class Actor:
                 return self._is_dead
         
         def kill(self):
-                self._is_dead = True
+                if not self._is_dead:
+                        self._is_dead = True
+                        self._stage.actor_killed(self)
 
         def evolve_into(self, class_object, icon_file, delay=5):
                 ''' Replace self with an actor of a new class from class_object
@@ -73,11 +253,14 @@ class Actor:
                         
                 self._stage.add_actor(class_object(icon_file, self._stage,
                                                    self._x, self._y, delay))
+                if isinstance(self, Monster):
+                        self._stage.count_evolution()
                 
                 
 class Player(Actor):
         ''' A Player is an Actor that can handle events. These typically come
         from the user, for example key presses etc. '''
+        __slots__ = ('_player_number',)
 
         def __init__(self, icon_file, stage, x=0, y=0, player_number = 1):
                 Actor.__init__(self, icon_file, stage, x, y, player_number)
@@ -87,14 +270,38 @@ class Player(Actor):
         def handle_event(self, event):
                 ''' Used to register the occurrence of an event with self. '''
                 pass
+
+        def has_event(self):
+                ''' whether self has an event to act on when it next steps '''
+                return False
         
         def get_player_number(self):
                 '''return the player number (to identify player objects)
                 '''
                 return self._player_number
 
+        def move(self, other, dx, dy):
+                ''' other is telling us to move in direction (dx, dy), move
+                (when possible) and return whether moved in that direction. 
+                '''
+                #sets where this player plans to move
+                new_x = self._x + dx
+                new_y = self._y + dy
+                
+                if not self._stage.is_in_bounds(new_x, new_y):
+                        return False
+                
+                if other != self: #no one pushes me around
+                        return False
+
+                if self.infront_moveable(new_x, new_y, dx, dy):
+                        return Actor.move(self, other, dx, dy)
+                
+                return False
+
 class KeyboardPlayer(Player):
         ''' A KeyboardPlayer is a Player that can handle keypress events '''
+        __slots__ = ('_last_event',)
         
         def __init__(self, icon_file, stage, x=0, y=0, player_number = 1):
                 Player.__init__(self, icon_file, stage, x, y, player_number)
@@ -105,6 +312,13 @@ class KeyboardPlayer(Player):
                 ignores all previous events since self last took a step.
                 '''
                 self._last_event=event 
+                self._stage.wake(self)
+
+        def get_last_event(self):
+                return self._last_event
+
+        def has_event(self):
+                return self._last_event is not None
         
         def step(self):
                 ''' Take a single step in the animation. 
@@ -113,6 +327,7 @@ class KeyboardPlayer(Player):
                 #players are removed differently from the stage
                 if self.is_dead():
                         self._stage.remove_player(self)
+                        return
                      
                 if self._last_event is not None:
 
@@ -161,29 +376,46 @@ class KeyboardPlayer(Player):
 
                         self._last_event=None 
 
-        def move(self, other, dx, dy):
-                ''' other is telling us to move in direction (dx, dy), move
-                (when possible) and return whether moved in that direction. 
+class Remote_Player(Player):
+        ''' A Remote_Player is a Player moved by a client over the network,
+        its events are direction codes, indexes into DIRECTIONS
+        '''
+        __slots__ = ('_direction',)
+
+        def __init__(self, icon_file, stage, x=0, y=0, player_number = 1):
+                Player.__init__(self, icon_file, stage, x, y, player_number)
+                self._direction = None #the code last sent, until self steps
+
+        def handle_event(self, event):
+                ''' Record the direction code event, replacing any earlier
+                one sent since self last took a step
                 '''
-                #sets where this player plans to move
-                new_x = self._x + dx
-                new_y = self._y + dy
-                
-                if not self._stage.is_in_bounds(new_x, new_y):
-                        return False
-                
-                if other != self: #no one pushes me around
-                        return False
+                if 0 <= event < len(DIRECTIONS):
+                        self._direction = event
+                        self._stage.wake(self)
+
+        def get_direction(self):
+                return self._direction
+
+        def has_event(self):
+                return self._direction is not None
+
+        def step(self):
+                ''' Move in the last direction sent, if any '''
+                if self.is_dead():
+                        self._stage.remove_player(self)
+                        return
+
+                if self._direction is not None:
+                        dx, dy = DIRECTIONS[self._direction]
+                        self.move(self, dx, dy)
+                        self._direction = None
 
-                if self.infront_moveable(new_x, new_y, dx, dy):
-                        return Actor.move(self, other, dx, dy)
-                
-                return False
-                               
 class Box(Actor):
         '''An actor that can be moved around by Player and trap monsters (may
         have special abilities)
         '''
+        __slots__ = ()
         
         def move(self, other, dx, dy):
                 ''' other is telling us to move in direction (dx, dy), move
@@ -197,15 +429,26 @@ class Box(Actor):
                         return False
                         
                 if self.infront_moveable(new_x, new_y, dx, dy):
-                        return Actor.move(self, other, dx, dy)
+                        return self.pushed(other, dx, dy)
                 
                 return False
+
+        def is_pushable(self):
+                return True
+
+        def pushed(self, other, dx, dy):
+                ''' other pushed self in direction (dx, dy), and the way is
+                clear, so move
+                '''
+                return Actor.move(self, other, dx, dy)
         
 
 class Ice_Box(Box):
         ''' A special kind of box that can freeze mosters when a introduced to
         them (also known as sticky box)
         '''
+        __slots__ = ('_frozen_monsters',)
+
         def __init__(self, icon_file, stage, x=0, y=0, delay = 5):
                 Box.__init__(self, icon_file, stage, x, y, delay)
                 self._frozen_monsters = []
@@ -215,22 +458,29 @@ class Ice_Box(Box):
         def add_to_frozen(self, monster):
                 self._frozen_monsters.append(monster)
 
-        def move(self, other, dx, dy):
-                ''' other is telling us to move in direction (dx, dy), move
-                (when possible) and return whether moved in that direction. 
+        def get_frozen_monsters(self):
+                return self._frozen_monsters
+
+        def pushed(self, other, dx, dy):
+                ''' other pushed self in direction (dx, dy), and the way is
+                clear, so move
                 '''
-                if Box.move(self, other, dx, dy):
-                        #removes all the monsters that are stuck to the box and
-                        #resets there frozen state
-                        while self._frozen_monsters != []:
-                                self._frozen_monsters.pop().set_frozen(False)
-                        return True
-                return False
+                Box.pushed(self, other, dx, dy)
+                #removes all the monsters that are stuck to the box and
+                #resets there frozen state
+                while self._frozen_monsters != []:
+                        self._frozen_monsters.pop().set_frozen(False)
+                return True
         
 
 class Wall(Box):
         '''A special kind of Actor that cannot be moved (Also known as Earth_Wall)
         '''
+        __slots__ = ()
+
+        def is_pushable(self):
+                return False
+
         def move(self, other, dx, dy):
                 return False #Nothing can move a wall
         
@@ -238,6 +488,8 @@ class Fire_Wall(Wall):
         '''A special kind of Wall that replaces anything that tries to move it
         with itself
         '''     
+        __slots__ = ()
+
         def move(self, other, dx, dy):
                 if isinstance(other, Ice_Box): 
                         self.kill() #Ice_Boxes can 'put out' Fire_Walls
@@ -247,6 +499,8 @@ class Fire_Wall(Wall):
 class Monster(Actor):
         ''' A special type of actor that kills players and moves independently
         '''
+        __slots__ = ('_dx', '_dy', '_is_frozen')
+
         def __init__(self, icon_file, stage, x=0, y=0, delay=5):
                 Actor.__init__(self, icon_file, stage, x, y, delay)
                 self._dx=1
@@ -255,7 +509,18 @@ class Monster(Actor):
                 #indicates whether the monster is stuck to the box
 
         def set_frozen(self, frozen_bool):
-                self._is_frozen = frozen_bool
+                if frozen_bool != self._is_frozen:
+                        self._is_frozen = frozen_bool
+                        self._stage.frozen_changed(self)
+
+        def is_frozen(self):
+                return self._is_frozen
+
+        def get_direction(self):
+                return (self._dx, self._dy)
+
+        def set_direction(self, dx, dy):
+                (self._dx, self._dy) = (dx, dy)
                 
         def is_dead(self):
                 ''' Return whether self has died. That is, if self is surrounded
@@ -263,18 +528,8 @@ class Monster(Actor):
                 the stage.
                 '''
                 if not Actor.is_dead(self):
-                        for x in range(-1,2): 
-                                for y in range(-1,2):
-
-                                        around = self._stage.get_actor(
-                                                self._x+x, self._y+y)
-                                        
-                                        if(self._stage.is_in_bounds(self._x+x,
-                                                                    self._y+y)
-                                           
-                                        and (around == None or isinstance(
-                                                around, Player))):
-                                                return False                                                                       
+                        if self._stage.count_free_around(self._x, self._y) > 0:
+                                return False
                 self.kill()
                 return True
 
@@ -283,6 +538,9 @@ class Monster(Actor):
                 Also removes dead monsters or delays them accordingly
                 '''
                 Actor.step(self)
+                if self._is_dead: #dead monsters are gone at the end of the step
+                        return
+
                 if not self.delay():
                         return
                 
@@ -318,7 +576,7 @@ class Monster(Actor):
                 if isinstance(other, Ice_Box):
                         if not self._is_frozen:
                                 other.add_to_frozen(self)
-                                self._is_frozen = True
+                                self.set_frozen(True)
                                 return False
                         
                 if other != self: #no one pushes me around
@@ -330,7 +588,7 @@ class Monster(Actor):
                 if isinstance(infront, Ice_Box):
                         if not self._is_frozen:
                                 infront.add_to_frozen(self)
-                                self._is_frozen = True
+                                self.set_frozen(True)
                                 return False
 
                 #Fire_Walls can kill monsters or make them evolve where
@@ -357,9 +615,15 @@ class Shy_Monster(Monster):
          ''' A special kind of monster that looks like a box at some times and
          moves sparatically when the player is near
          '''
+         __slots__ = ('_disguise_file', '_diguise')
+
          def __init__(self, icon_file, disguise_file , stage, x=0, y=0, delay=5):
                  Monster.__init__(self, icon_file, stage, x, y, delay)
-                 self._diguise = pygame.image.load(disguise_file)
+                 self._disguise_file = disguise_file
+                 self._diguise = stage.load_icon(disguise_file)
+
+         def get_disguise_file(self):
+                 return self._disguise_file
 
          def surroundings(self, class_object):
                  '''Find the specfic object of class_object near self, if not present,
@@ -392,7 +656,7 @@ class Shy_Monster(Monster):
                  if isinstance(other, Ice_Box):
                         if not self._is_frozen:
                                 other.add_to_frozen(self)
-                                self._is_frozen = True
+                                self.set_frozen(True)
                                 return False
                         
                  x, y = self.surroundings(Player)
@@ -435,6 +699,9 @@ class Shy_Monster(Monster):
                                                                               
                 
 
+         def is_animated(self):
+                return True
+
          def get_icon(self):
                 '''randomly change the monsters icon to its true self or its
                 disguise
@@ -448,39 +715,49 @@ class Shy_Monster(Monster):
 class Stalker_Monster(Monster):
         '''A special kind of monster that follows the player around on screen
         '''
+        __slots__ = ()
         
         def stalk(self):
-                player1, player2 = self._stage.get_players()
+                ''' head for the nearest player along a shortest path around
+                the boxes, read from the stage's distance field. Without a
+                known path (every player out of reach), head straight for the
+                nearest player.
+                '''
+                players = [p for p in self._stage.get_players() if p != None]
 
-                if player1 == None and player2 == None:
+                if players == []:
                         self._dx, self._dy = 0,0
-                else:
-                        if player1 != None and player2 != None:
-                                player_x, player_y = player1.get_position()
+                        return
 
-                        if player1 == None:
-                                player_x, player_y = player2.get_position()
+                #the nearest player as the crow flies, to break ties and as a
+                #last resort
+                nearest = min(players, key=lambda p: max(
+                        abs(p.get_position()[0] - self._x),
+                        abs(p.get_position()[1] - self._y)))
+                (player_x, player_y) = nearest.get_position()
+                towards = (self._sign(player_x - self._x),
+                           self._sign(player_y - self._y))
+                (self._dx, self._dy) = towards
+
+                field = self._stage.get_distance_field()
+                distance = field.get((self._x, self._y))
+                if distance is None or distance == 0:
+                        return
 
-                        if player2 == None:
-                                player_x, player_y = player1.get_position()
-                        
-                        if player_x == self._x:
-                                self._dx = 0
-                                
-                        elif player_x < self._x:
-                                self._dx = -1
-                        
-                        else:
-                                self._dx = 1
-                        
-                        if player_y == self._y:
-                                self._dy = 0
-                        
-                        elif player_y < self._y:
-                                self._dy = -1
-                        
-                        else:
-                                self._dy = 1
+                best = field.get((self._x + towards[0], self._y + towards[1]))
+                for (dx, dy) in DIRECTIONS:
+                        closer = field.get((self._x + dx, self._y + dy))
+                        if closer is not None and (best is None or
+                                                   closer < best):
+                                (self._dx, self._dy) = (dx, dy)
+                                best = closer
+
+        def _sign(self, n):
+                if n == 0:
+                        return 0
+                elif n < 0:
+                        return -1
+                return 1
         
         def step(self):
                  Monster.step(self)
@@ -489,6 +766,7 @@ class Stalker_Monster(Monster):
 class Fire_Monster(Monster):
          ''' A special kind of monster that turns into a Fire_Wall when dead
          '''
+         __slots__ = ()
  
          def is_dead(self):
                 ''' Return whether self has died and evolve accordingly  '''
@@ -502,6 +780,7 @@ class Earth_Monster(Monster):
          ''' A special kind of monster that turns into an Earth_Wall (aka Wall)
          when dead
          '''
+         __slots__ = ()
 
          def is_dead(self):
                 ''' Return whether self has died and evolve accordingly  '''
@@ -515,6 +794,7 @@ class Ice_Monster(Monster):
          ''' A special kind of monster that turns into an Ice_Box aka Sticky Box
          when dead
          '''
+         __slots__ = ()
         
          def is_dead(self):
                 ''' Return whether self has died and evolve accordingly  '''
@@ -524,20 +804,225 @@ class Ice_Monster(Monster):
                         return True
                 return False
 
+class Change_Set:
+        ''' What changed on a stage during a step (and since the step before):
+        actors that moved, appeared, went or were frozen or unfrozen and
+        players that died. Each kind of change is a flat list, of ids and
+        numbers rather than tuples, in the order the changes happened:
+
+                moved   actor id, old x, old y, new x, new y for each move
+                spawned actors put on the stage (the actors themselves)
+                removed ids of actors taken off the stage
+                frozen  monster id, 1 if frozen or 0 if unfrozen
+                died    numbers of players that died
+
+        The stage reuses the same lists every step, so a change set is only
+        valid until the stage steps again.
+        '''
+        __slots__ = ('_moved', '_spawned', '_removed', '_frozen', '_died')
+
+        def __init__(self):
+                self._moved = []
+                self._spawned = []
+                self._removed = []
+                self._frozen = []
+                self._died = []
+
+        def clear(self):
+                del self._moved[:]
+                del self._spawned[:]
+                del self._removed[:]
+                del self._frozen[:]
+                del self._died[:]
+
+        def add_moved(self, actor_id, old_x, old_y, x, y):
+                self._moved.extend((actor_id, old_x, old_y, x, y))
+
+        def add_spawned(self, actor):
+                self._spawned.append(actor)
+
+        def add_removed(self, actor_id):
+                self._removed.append(actor_id)
+
+        def add_frozen(self, monster_id, frozen_bool):
+                self._frozen.extend((monster_id, int(frozen_bool)))
+
+        def add_died(self, player_number):
+                self._died.append(player_number)
+
+        def is_empty(self):
+                return not (self._moved or self._spawned or self._removed or
+                            self._frozen or self._died)
+
+        def get_moved(self):
+                return self._moved
+
+        def get_spawned(self):
+                return self._spawned
+
+        def get_removed(self):
+                return self._removed
+
+        def get_frozen(self):
+                return self._frozen
+
+        def get_died(self):
+                return self._died
+
+class Camera:
+        ''' A view of part of a stage, drawn into a rectangle of the stage's
+        screen. A camera can follow a player, keeping them in the middle of
+        the view (as far as the view can stay on the stage), and only draws
+        the actors it can see.
+        '''
+
+        def __init__(self, stage, rect, player_number=None):
+                self._stage = stage
+                self._rect = pygame.Rect(rect) #where on the screen
+                self._player_number = player_number #None for a still view
+                d = stage.get_icon_dimension()
+                #the cells seen, a part cell at the right or bottom edge
+                #counts
+                self._columns = -(-self._rect.width // d)
+                self._rows = -(-self._rect.height // d)
+                (self._x, self._y) = (0, 0) #the top left cell seen
+                self._rects = {} #cell -> where it is drawn, for an atlas
+                self.follow()
+
+        def get_rect(self):
+                return self._rect
+
+        def get_view(self):
+                ''' return (x, y, columns, rows), the cells seen '''
+                return (self._x, self._y, self._columns, self._rows)
+
+        def look_at(self, x, y):
+                ''' centre the view on cell (x, y), keeping it on the stage '''
+                (old_x, old_y) = (self._x, self._y)
+                self._x = max(min(x - self._columns // 2,
+                                  self._stage.get_width() - self._columns), 0)
+                self._y = max(min(y - self._rows // 2,
+                                  self._stage.get_height() - self._rows), 0)
+                if (self._x, self._y) != (old_x, old_y):
+                        self._rects.clear() #the cells are drawn elsewhere
+
+        def follow(self):
+                ''' look at the player followed, if they are still alive '''
+                if self._player_number is None:
+                        return
+                player = self._stage.get_player(self._player_number)
+                if player is not None:
+                        self.look_at(*player.get_position())
+
+        def draw(self, screen, colour, pic=None):
+                ''' draw the view onto screen, on colour and the part of the
+                stage picture pic under it
+                '''
+                d = self._stage.get_icon_dimension()
+                (left, top) = (self._rect.x - self._x*d,
+                               self._rect.y - self._y*d)
+                screen.set_clip(self._rect)
+                screen.fill(colour, self._rect)
+                if pic is not None:
+                        screen.blit(pic, self._rect.topleft,
+                                    pygame.Rect(self._x*d, self._y*d,
+                                                self._rect.width,
+                                                self._rect.height))
+                actors = self._stage.get_actors_in(self._x, self._y,
+                                                   self._columns, self._rows)
+                if self._stage.get_atlas() is not None:
+                        screen.blits(self._stage.sprites(
+                                actors, self._rects, left, top),
+                                     doreturn=False)
+                else:
+                        for a in actors:
+                                (x, y) = a.get_position()
+                                screen.blit(a.get_icon(),
+                                            (left + x*d, top + y*d))
+                screen.set_clip(None)
+
+def _hides_colour(pic, size):
+        ''' whether pic, drawn at the top left, covers an area of size
+        (width, height) without a pixel that can be seen through
+        '''
+        if pic is None or pic.get_width() < size[0] or \
+           pic.get_height() < size[1] or pic.get_colorkey() is not None:
+                return False
+        if not pic.get_flags() & pygame.SRCALPHA:
+                return pic.get_alpha() in (None, 255)
+        area = pic.subsurface(pygame.Rect((0, 0), size))
+        return pygame.mask.from_surface(area, 254).count() == size[0] * size[1]
+
 class Stage:
         
         def __init__(self, width, height, icon_dimension, pic, colour = 0,
-                     colour_change = 5):
+                     colour_change = 5, headless = False, surface = None,
+                     field_radius = 64, window_size = None):
 
-                # all actors on this stage (monsters, player, boxes, ...)
-                self._actors=[] 
+                # all actors on this stage (monsters, player, boxes, ...) by
+                # id, in the order they were added (ids only ever increase)
+                self._actors={}
+                self._next_id=0
 
-                #special actors, the players
-                self._player1 = None 
-                self._player2 = None 
+                # while stepping, actors added or removed are queued and only
+                # put on or taken off the stage once every actor has stepped
+                self._stepping=False
+                self._pending=[] #(actor, True to add or False to remove)
+
+                # index of the actors by cell, (x,y) -> actors at that cell in
+                # the same order as self._actors, so lookups are O(1)
+                self._cells={}
+
+                #special actors, the players, by player number
+                self._players = {}
                 
                 # the logical width and height of the stage
                 self._width, self._height = width, height
+
+                # steps from each cell within field_radius of a player to the
+                # nearest player, going around boxes, shared by the stalkers.
+                # It is found when first asked for and again once a player
+                # (at _field_sources) has come, gone or moved, in between
+                # only the cells around boxes that came or went (in
+                # _field_cells) are searched again
+                self._field = None
+                self._field_radius = field_radius
+                self._field_sources = set()
+                self._field_cells = set()
+
+                # for every cell, the number of cells in the 3x3 square
+                # around it that are not free (a Box, Wall or Monster first),
+                # kept up to date as actors come and go. The counts are kept
+                # in CHUNK_SIZE x CHUNK_SIZE chunks (row by row, a byte each),
+                # a chunk is only made once one of its counts is not 0 and
+                # dropped when they all are again, so empty space on a huge
+                # stage costs nothing
+                self._blocked = {} #(x, y) >> CHUNK_BITS -> counts
+                self._blocked_total = {} #(x, y) >> CHUNK_BITS -> their sum
+
+                # the actors that do something every time they step, by id
+                # in id order. Boxes and walls only ever step to leave the
+                # stage once killed, so they are left asleep (wherever they
+                # are, however many) until then
+                self._movers = {}
+                self._movers_sorted = True
+                self._woken = [] #(id, actor) to step in the next step
+                self._woken_now = [] #heap of those to step this step
+                self._stepping_id = None #the id of the actor stepping
+                self._first_new_id = 0 #the first id given during the step
+
+                # monsters and players whose steps would do nothing for a
+                # while (a monster counting down its delay, a player with no
+                # key pressed) wait, unstepped, until they are due or woken
+                # by a key, being killed or being boxed in. A waiting
+                # monster's delay count is caught up from the step it last
+                # took. The wheel holds the monsters due by step, entries
+                # of monsters woken early are left there and skipped.
+                self._ticks = 0 #steps taken
+                self._waiting = {} #id -> (monster, last step, due step,
+                                   #delay count then)
+                self._wheel = {} #step -> [(id, monster)] due then
+                self._idle = {} #id -> player waiting for an event
                 
                 # the pixel dimension of all actors
                 self._icon_dimension=icon_dimension
@@ -547,14 +1032,64 @@ class Stage:
                 self._pixel_height = self._icon_dimension * self._height
                 self._pixel_size = self._pixel_width, self._pixel_height
 
-                # get a screen of the appropriate dimension to draw on
-                self._screen = pygame.display.set_mode(self._pixel_size)
+                # a headless stage never opens a window or decodes icons, it
+                # is only simulated (batch runs, regression tests, ...)
+                self._headless = headless
+
+                # get a screen of the appropriate dimension to draw on (the
+                # whole stage, unless window_size (in pixels) is given, then
+                # cameras show parts of it), or draw offscreen onto surface
+                # when one is given
+                self._on_display = not headless and surface is None
+                if headless:
+                        self._screen = None
+                elif surface is not None:
+                        self._screen = surface
+                else:
+                        self._screen = pygame.display.set_mode(
+                                window_size or self._pixel_size)
+
+                # views of parts of self, drawn instead of the whole stage
+                # when there are any
+                self._cameras = []
                 self._stage_pic = pic #background of the stage
+                #whether pic hides the background colour everywhere, then a
+                #change of colour does not need the whole stage redrawn
+                self._colour_hidden = _hides_colour(pic, self._pixel_size)
                 self._colour = colour #starting colour number 
                 self._colour_change = colour_change
                 #the factor that the stage colour changes by
 
+                # cells that changed since the last draw, and actors whose
+                # icon can change without them moving (always redrawn)
+                self._dirty = set()
+                self._animated = set()
+                self._drawn_colour = None #background colour on the screen
+
+                # a Sprite_Atlas to draw actors from in batches, or None to
+                # blit their icons one at a time, and the rect each cell is
+                # drawn in, made once and reused every draw
+                self._atlas = None
+                self._cell_rects = {}
+
                 self._is_winner = False
+                self._monster_count = 0 #monsters on self, for game_over
+
+                # what changed since the changes were last published, and
+                # the callbacks they are published to
+                self._changes = Change_Set()
+                self._subscribers = []
+
+                # statistics for balancing levels
+                self._evolutions = 0 #monsters that evolved into something
+                self._player_deaths = 0
+
+                # a wwprofile.Tick_Profiler timing the steps and draws of self
+                # or None, WW_PROFILE in the environment profiles every stage
+                self._profiler = None
+                if os.environ.get("WW_PROFILE"):
+                        import wwprofile
+                        wwprofile.environment_profiler().attach(self)
 
         def is_in_bounds(self, x,y):
                 return self.is_in_bounds_x(x) and self.is_in_bounds_y(y)
@@ -570,6 +1105,68 @@ class Stage:
 
         def get_height(self): 
                 return self._height
+
+        def get_icon_dimension(self):
+                return self._icon_dimension
+
+        def get_field_radius(self):
+                return self._field_radius
+
+        def get_colour(self):
+                return self._colour
+
+        def get_colour_change(self):
+                return self._colour_change
+
+        def is_headless(self):
+                return self._headless
+
+        def set_colour_change(self, colour_change):
+                ''' set the step of the background colour pulse, 0 stops it '''
+                self._colour_change = colour_change
+
+        def load_icon(self, icon_file):
+                ''' return the image in icon_file for an actor on self, or None
+                if self is headless and never draws
+                '''
+                if self._headless:
+                        return None
+                return load_icon(icon_file)
+
+        def set_atlas(self, atlas):
+                ''' draw actors from the Sprite_Atlas atlas, in one batch a
+                draw (or one at a time again if atlas is None). Icons that
+                are not in atlas are still drawn, from their own surfaces.
+                '''
+                self._atlas = atlas
+                self._drawn_colour = None #redraw everything
+
+        def get_atlas(self):
+                return self._atlas
+
+        def sprites(self, actors, rects, left=0, top=0):
+                ''' return the (source, dest, area) blits that draw actors
+                from self's atlas, each into the rect of its cell offset by
+                (left, top) pixels, reusing the rects kept by cell in rects
+                '''
+                surface = self._atlas.get_surface()
+                areas = self._atlas.get_areas()
+                d = self._icon_dimension
+                batch = []
+                for a in actors:
+                        icon = a.get_icon()
+                        cell = a.get_position()
+                        rect = rects.get(cell)
+                        if rect is None:
+                                rect = rects[cell] = pygame.Rect(
+                                        left + cell[0]*d, top + cell[1]*d,
+                                        d, d)
+                        area = areas.get(icon)
+                        if area is None:
+                                batch.append((icon, rect))
+                        else:
+                                batch.append((surface, rect, area))
+                return batch
         
         def is_winner(self):
                 return self._is_winner
@@ -578,110 +1175,802 @@ class Stage:
                 ''' A Player is a special actor, self may need to contact them
                 directly
                 '''
-
-                self._player1 = player1
-                self.add_actor(self._player1)
-                
-                self._player2 = player2
+                self.add_player(player1)
                 
                 if player2 != None:#in single player mode, player2 doesn't exist
-                        self.add_actor(self._player2)
+                        self.add_player(player2)
+
+        def add_player(self, player):
+                ''' put player on self in the slot for its player number,
+                there can be any number of players
+                '''
+                self._players[player.get_player_number()] = player
+                self._field_cells.add(player.get_position())
+                self.add_actor(player)
+
+        def get_player(self, player_number):
+                ''' return the player in slot player_number, None if the slot
+                is empty
+                '''
+                return self._players.get(player_number)
                                         
+        def count_evolution(self):
+                ''' note that a monster on self evolved '''
+                self._evolutions += 1
+
+        def get_evolution_count(self):
+                return self._evolutions
+
+        def get_player_death_count(self):
+                return self._player_deaths
+
+        def set_counts(self, evolutions, player_deaths):
+                ''' set the counts of evolutions and player deaths, for
+                rebuilding a saved stage
+                '''
+                self._evolutions = evolutions
+                self._player_deaths = player_deaths
+
         def get_players(self):
-                return (self._player1, self._player1) 
+                ''' return the players on self, by player number '''
+                return [self._players[n] for n in sorted(self._players)]
 
         def remove_player(self, other):
 
                 #The identity of the player is necessary to remove the correct
                 #actor, so player_number is a must
-                if other.get_player_number() == 1:
-                        self.remove_actor(self._player1)
-                        self._player1=None
-                        
-                elif other.get_player_number() == 2:
-                        self.remove_actor(self._player2)
-                        self._player2=None
-                        
-                
+                if self._players.get(other.get_player_number()) is other:
+                        del self._players[other.get_player_number()]
+                        #during a step the player only leaves its cell once
+                        #every actor has stepped, but it is no longer chased
+                        self._field_cells.add(other.get_position())
+                self.remove_actor(other)
+
+                if other.is_dead():
+                        self._player_deaths += 1
+                        self._changes.add_died(other.get_player_number())
 
         def player_event(self, event):
-                ''' Send a user event to the player (this is a special Actor).
+                ''' Send a user key event to the keyboard player it moves (players
+                are special Actors).
                 '''
-                movement_p1 = [pygame.K_w, pygame.K_e, pygame.K_r, pygame.K_c,
-                               pygame.K_s, pygame.K_d, pygame.K_z, pygame.K_x]
-                
-                movement_p2 = [pygame.K_y, pygame.K_u, pygame.K_i, pygame.K_h,
-                               pygame.K_j, pygame.K_b, pygame.K_n, pygame.K_m]
-
-                #because one player can die while the other lives, None must
-                #be checked for both players
-                if (self._player1 != None) and (event in movement_p1):
-                    self._player1.handle_event(event)
-
-                elif (self._player2 != None) and  (event in movement_p2):
-                    self._player2.handle_event(event)
+                #because one player can die while the other lives, an empty
+                #slot must be checked for
+                for (player_number, keys) in PLAYER_KEYS.items():
+                        if event in keys:
+                                player = self._players.get(player_number)
+                                if player != None:
+                                        player.handle_event(event)
+                                        return
 
         def add_actor(self, actor):
-                self._actors.append(actor)
+                ''' put actor on self and give it an id, during a step this
+                happens once every actor has stepped
+                '''
+                actor.set_id(self._next_id)
+                self._next_id += 1
+                if self._stepping:
+                        self._pending.append((actor, True))
+                else:
+                        self._add(actor)
 
         def remove_actor(self, actor):
-                self._actors.remove(actor)        
+                ''' take actor off self, during a step this happens once every
+                actor has stepped
+                '''
+                if self._stepping:
+                        self._pending.append((actor, False))
+                else:
+                        self._remove(actor)
+
+        def get_next_id(self):
+                return self._next_id
+
+        def set_next_id(self, next_id):
+                ''' set the id the next added actor gets, ids must only ever
+                increase, so this is for rebuilding a saved stage
+                '''
+                self._next_id = next_id
+
+        def has_actor(self, actor):
+                return self._actors.get(actor.get_id()) is actor
+
+        def _add(self, actor):
+                actor_id = actor.get_id()
+                self._actors[actor_id] = actor
+                self._changes.add_spawned(actor)
+                if isinstance(actor, Monster):
+                        self._monster_count += 1
+                if self._waits(actor):
+                        pass #once it is in its cell
+                elif not self._sleeps(actor):
+                        if self._movers and \
+                           actor_id < next(reversed(self._movers)):
+                                self._movers_sorted = False
+                        self._movers[actor_id] = actor
+                elif actor.is_dead():
+                        self._woken.append((actor_id, actor))
+                self._add_to_cell(actor, actor.get_position())
+                if self._waits(actor):
+                        self._rest(actor)
+                if actor.is_animated():
+                        self._animated.add(actor)
+
+        def _remove(self, actor):
+                if not self.has_actor(actor): #already gone
+                        return
+                del self._actors[actor.get_id()]
+                if isinstance(actor, Monster):
+                        self._monster_count -= 1
+                self._movers.pop(actor.get_id(), None)
+                self._waiting.pop(actor.get_id(), None)
+                self._idle.pop(actor.get_id(), None)
+                self._changes.add_removed(actor.get_id())
+                self._remove_from_cell(actor, actor.get_position())
+                self._animated.discard(actor)
+
+        def move_actor(self, actor, old_x, old_y):
+                ''' actor has moved from (old_x, old_y) to its current
+                position, update the cell index accordingly
+                '''
+                if not self.has_actor(actor): #not on the stage (yet)
+                        return
+                self._remove_from_cell(actor, (old_x, old_y))
+                self._add_to_cell(actor, actor.get_position())
+                (x, y) = actor.get_position()
+                self._changes.add_moved(actor.get_id(), old_x, old_y, x, y)
+
+        def _sleeps(self, actor):
+                ''' whether actor only steps to leave once dead '''
+                return type(actor).step is Actor.step
+
+        def _waits(self, actor):
+                ''' whether actor's step does nothing but count down its delay
+                while it has free space around it (a Monster, with a delay
+                of at least WAIT_DELAY) or while it has no event (a Player)
+                '''
+                step = type(actor).step
+                if step is Monster.step:
+                        return actor.get_delay() >= WAIT_DELAY
+                return step is KeyboardPlayer.step or \
+                       step is Remote_Player.step
+
+        def actor_killed(self, actor):
+                ''' actor was killed, wake it to step (and leave) when it would
+                have if every actor stepped
+                '''
+                if not self.has_actor(actor):
+                        return #new actors are seen to
+                if self._waits(actor):
+                        self.wake(actor)
+                elif self._sleeps(actor):
+                        self._schedule(actor)
+
+        def _schedule(self, actor):
+                ''' step actor in this step if its turn has not come yet, else
+                in the next
+                '''
+                actor_id = actor.get_id()
+                if self._stepping and self._stepping_id < actor_id < \
+                   self._first_new_id:
+                        heapq.heappush(self._woken_now, (actor_id, actor))
+                else:
+                        self._woken.append((actor_id, actor))
+
+        def _rest(self, actor):
+                ''' actor waits or has just stepped, let it wait until its
+                step would do something, or step it next time
+                '''
+                actor_id = actor.get_id()
+                ticks = self._ticks
+                if isinstance(actor, Player):
+                        if not actor.is_dead() and not actor.has_event():
+                                self._idle[actor_id] = actor
+                                return
+                else:
+                        count = actor.get_delay_count()
+                        due = ticks + actor.get_delay() - count
+                        (x, y) = actor.get_position()
+                        #Actor.is_dead, a monster's would look around
+                        if due > ticks + 1 and not Actor.is_dead(actor) and \
+                           self.count_free_around(x, y) > 0:
+                                self._waiting[actor_id] = (actor, ticks, due,
+                                                           count)
+                                bucket = self._wheel.get(due)
+                                if bucket is None:
+                                        self._wheel[due] = [(actor_id, actor)]
+                                else:
+                                        bucket.append((actor_id, actor))
+                                return
+                self._woken.append((actor_id, actor))
+
+        def _waited_count(self, actor_id, entry):
+                ''' return the delay count of the waiting monster with
+                actor_id and waiting entry, counting this step once its turn
+                in it has come
+                '''
+                if self._stepping and self._stepping_id < actor_id:
+                        return entry[3] + self._ticks - 1 - entry[1]
+                return entry[3] + self._ticks - entry[1]
+
+        def waiting_delay_count(self, actor):
+                ''' return the delay count of actor while it waits, else None
+                '''
+                entry = self._waiting.get(actor.get_id())
+                if entry is None or entry[0] is not actor:
+                        return None
+                return self._waited_count(actor.get_id(), entry)
+
+        def wake(self, actor):
+                ''' actor has something to do, if it waits step it from its
+                next turn on
+                '''
+                actor_id = actor.get_id()
+                if self._idle.get(actor_id) is actor:
+                        del self._idle[actor_id]
+                        self._schedule(actor)
+                        return
+                entry = self._waiting.get(actor_id)
+                if entry is None or entry[0] is not actor:
+                        return
+                del self._waiting[actor_id]
+                actor.set_delay_count(self._waited_count(actor_id, entry))
+                self._schedule(actor)
+
+        def _wake_surrounded(self, cell):
+                ''' wake the waiting monsters around cell with no free space
+                around them, so they step (and die) in turn
+                '''
+                (x, y) = cell
+                for j in (y-1, y, y+1):
+                        for i in (x-1, x, x+1):
+                                for a in self._cells.get((i, j), ()):
+                                        if a.get_id() in self._waiting and \
+                                           self.count_free_around(i, j) == 0:
+                                                self.wake(a)
+
+        def frozen_changed(self, monster):
+                ''' monster was frozen or unfrozen '''
+                if self.has_actor(monster):
+                        self._changes.add_frozen(monster.get_id(),
+                                                 monster.is_frozen())
+
+        def _add_to_cell(self, actor, cell):
+                ''' insert actor at cell, keeping the actors at cell in the
+                order they appear in self._actors
+                '''
+                if not self._headless:
+                        self._dirty.add(cell)
+                if self._field is not None and \
+                   isinstance(actor, (Box, Player)):
+                        self._field_cells.add(cell)
+                actors = self._cells.get(cell)
+                if actors is None:
+                        actors = self._cells[cell] = []
+                was_free = actors == [] or isinstance(actors[0], Player)
+                actor_id = actor.get_id()
+                i = len(actors)
+                while i > 0 and actors[i-1].get_id() > actor_id:
+                        i -= 1
+                actors.insert(i, actor)
+                if was_free and not isinstance(actors[0], Player):
+                        self._count_free(cell, -1)
+                elif not was_free and isinstance(actors[0], Player):
+                        self._count_free(cell, 1)
+
+        def _remove_from_cell(self, actor, cell):
+                if not self._headless:
+                        self._dirty.add(cell)
+                if self._field is not None and \
+                   isinstance(actor, (Box, Player)):
+                        self._field_cells.add(cell)
+                actors = self._cells[cell]
+                was_free = isinstance(actors[0], Player)
+                actors.remove(actor)
+                if actors == []:
+                        del self._cells[cell]
+                        is_free = True
+                else:
+                        is_free = isinstance(actors[0], Player)
+                if was_free != is_free:
+                        self._count_free(cell, 1 if is_free else -1)
+
+        def _count_free(self, cell, change):
+                ''' cell became free (empty or with a Player first) or stopped
+                being free, add change to the free counts around it
+                '''
+                (x, y) = cell
+                if not self.is_in_bounds(x, y):
+                        return
+                (i, j) = (x & _CHUNK_MASK, y & _CHUNK_MASK)
+                if 0 < i < _CHUNK_MASK and 0 < j < _CHUNK_MASK:
+                        #the square is inside one chunk
+                        counts = self._chunk_counts((x >> CHUNK_BITS,
+                                                     y >> CHUNK_BITS), -9*change)
+                        i += j * CHUNK_SIZE
+                        for offset in _CHUNK_AROUND:
+                                counts[i + offset] -= change
+                        #a waiting monster is only boxed in once the count at
+                        #it is 9, away from the edges
+                        if change > 0 or not self._waiting or \
+                           (1 < x < self._width-2 and 1 < y < self._height-2
+                            and counts.find(9, i - _CHUNK_SPAN,
+                                            i + _CHUNK_SPAN + 1) < 0):
+                                return
+                else:
+                        for j in (y-1, y, y+1):
+                                for i in (x-1, x, x+1):
+                                        counts = self._chunk_counts(
+                                                (i >> CHUNK_BITS,
+                                                 j >> CHUNK_BITS), -change)
+                                        counts[(j & _CHUNK_MASK) * CHUNK_SIZE
+                                               + (i & _CHUNK_MASK)] -= change
+                        if change > 0 or not self._waiting:
+                                return
+                self._wake_surrounded(cell)
+
+        def _chunk_counts(self, key, change):
+                ''' return the counts of the chunk at key, whose sum is about to
+                change by change, making the chunk if it is new and dropping
+                it (it stays valid to update) if it is about to be all 0
+                '''
+                total = self._blocked_total.get(key, 0) + change
+                if total == 0:
+                        del self._blocked_total[key]
+                        return self._blocked.pop(key)
+                self._blocked_total[key] = total
+                counts = self._blocked.get(key)
+                if counts is None:
+                        counts = self._blocked[key] = bytearray(_CHUNK_AREA)
+                return counts
+
+        def count_free_around(self, x, y):
+                ''' return how many in bounds cells in the 3x3 square centred
+                on (x,y) are free, that is empty or with a Player first
+                '''
+                if 0 < x < self._width-1 and 0 < y < self._height-1:
+                        around = 9
+                else:
+                        around = (min(y+2, self._height) - max(y-1, 0)) * \
+                                 (min(x+2, self._width) - max(x-1, 0))
+                counts = self._blocked.get((x >> CHUNK_BITS, y >> CHUNK_BITS))
+                if counts is None:
+                        return around
+                return around - counts[(y & _CHUNK_MASK) * CHUNK_SIZE +
+                                       (x & _CHUNK_MASK)]
+
+        def get_chunk_count(self):
+                ''' return how many chunks of free counts self has made '''
+                return len(self._blocked)
+
+        def get_distance_field(self):
+                ''' return a dict from every cell within self's field radius of
+                a player to the number of steps (in any of the 8 directions,
+                going around boxes) from it to the nearest player
+                '''
+                if self._field is not None and self._field_cells and \
+                   self._player_cells() != self._field_sources:
+                        self._field = None
+                if self._field is None:
+                        self._field_sources = self._player_cells()
+                        self._field = self._find_distances()
+                elif self._field_cells:
+                        self._update_distances()
+                self._field_cells = set()
+                return self._field
+
+        def _player_cells(self):
+                return set(p.get_position() for p in self.get_players()
+                           if p != None)
+
+        def _find_distances(self):
+                ''' breadth first search out from every player '''
+                field = {}
+                frontier = []
+                for p in self.get_players():
+                        if p != None and p.get_position() not in field:
+                                field[p.get_position()] = 0
+                                frontier.append(p.get_position())
+
+                distance = 0
+                while frontier != [] and distance < self._field_radius:
+                        distance += 1
+                        reached = []
+                        for (x, y) in frontier:
+                                for (dx, dy) in DIRECTIONS:
+                                        cell = (x+dx, y+dy)
+                                        if cell in field or not \
+                                           self.is_in_bounds(x+dx, y+dy):
+                                                continue
+                                        if self._is_blocked(cell):
+                                                continue
+                                        field[cell] = distance
+                                        reached.append(cell)
+                        frontier = reached
+                return field
+
+        def _update_distances(self):
+                ''' bring the distance field up to date with the boxes that
+                came or went since it was last asked for, the players being
+                where they were. First the cells that lost their way to a
+                player (a box came) are taken out, going out from the
+                changed cells to every cell whose distance depended on them.
+                Then the distances are searched again, breadth first, from
+                the cells around those, only as far as the distances shrink.
+                Every cell ends up as _find_distances would have it.
+                '''
+                field = self._field
+                radius = self._field_radius
+                changed = self._field_cells
+                lost = {} #cell -> the distance it had
+                for cell in changed:
+                        if cell in field and field[cell] > 0 and \
+                           self._is_blocked(cell):
+                                lost[cell] = field[cell]
+
+                #a cell is lost with its last neighbour one step closer
+                levels = [[] for distance in range(radius + 1)]
+                for (cell, distance) in lost.items():
+                        levels[distance].append(cell)
+                for distance in range(radius):
+                        for (x, y) in levels[distance]:
+                                for (dx, dy) in DIRECTIONS:
+                                        cell = (x+dx, y+dy)
+                                        if field.get(cell) != distance + 1 \
+                                           or cell in lost:
+                                                continue
+                                        (cx, cy) = cell
+                                        for (ox, oy) in DIRECTIONS:
+                                                closer = (cx+ox, cy+oy)
+                                                if field.get(closer) == \
+                                                   distance and \
+                                                   closer not in lost:
+                                                        break
+                                        else:
+                                                lost[cell] = distance + 1
+                                                levels[distance+1].append(cell)
+                for cell in lost:
+                        del field[cell]
+
+                #search again from the cells next to the ones still known
+                levels = [[] for distance in range(radius + 1)]
+                for (x, y) in list(lost) + list(changed):
+                        if (x, y) in field or not self.is_in_bounds(x, y) or \
+                           self._is_blocked((x, y)):
+                                continue
+                        nearest = [field[(x+dx, y+dy)] for (dx, dy) in
+                                   DIRECTIONS if (x+dx, y+dy) in field]
+                        if nearest and min(nearest) < radius:
+                                field[(x, y)] = min(nearest) + 1
+                                levels[min(nearest) + 1].append((x, y))
+                for distance in range(radius):
+                        for (x, y) in levels[distance]:
+                                if field.get((x, y)) != distance:
+                                        continue #found closer since
+                                for (dx, dy) in DIRECTIONS:
+                                        cell = (x+dx, y+dy)
+                                        if field.get(cell, radius + 1) <= \
+                                           distance + 1 or not \
+                                           self.is_in_bounds(x+dx, y+dy) or \
+                                           self._is_blocked(cell):
+                                                continue
+                                        field[cell] = distance + 1
+                                        levels[distance+1].append(cell)
+
+        def _is_blocked(self, cell):
+                ''' whether a box sits at cell, for the distance field '''
+                for a in self._cells.get(cell, ()):
+                        if isinstance(a, Box):
+                                return True
+                return False
 
         def step(self):
                 ''' Take one step in the animation of the game. 
-                Do this by asking each of the actors to take a single step. '''
+                Do this by asking each of the actors to take a single step.
+                Actors added or removed meanwhile (dead actors, evolutions)
+                are put on or taken off the stage at the end of the step, in
+                the order it happened, so every actor present at the start
+                steps exactly once. Sleeping actors (boxes and walls that are
+                alive) and waiting ones (monsters between moves, players
+                with no key pressed) are skipped, their step would do
+                nothing, so a step costs as much as the actors with something
+                to do, whatever the size of the stage.
+                '''
+
+                if not self._movers_sorted:
+                        self._movers = dict(sorted(self._movers.items()))
+                        self._movers_sorted = True
+
+                #wake the monsters due this step, their delay counts one
+                #short of coming round
+                self._ticks += 1
+                woken = self._woken_now = self._woken
+                self._woken = []
+                waiting = self._waiting
+                for (actor_id, actor) in self._wheel.pop(self._ticks, ()):
+                        entry = waiting.get(actor_id)
+                        if entry is not None and entry[2] == self._ticks:
+                                del waiting[actor_id]
+                                actor.set_delay_count(actor.get_delay() - 1)
+                                woken.append((actor_id, actor))
+
+                #step the movers and the actors woken since the last step
+                #(and, as they are reached, during it) in id order
+                heapq.heapify(woken)
+                self._first_new_id = self._next_id
+                self._stepping = True
+                profiler = self._profiler
+                for a in self._movers.values():
+                        actor_id = a.get_id()
+                        while woken and woken[0][0] < actor_id:
+                                self._step_woken(*heapq.heappop(woken))
+                        self._stepping_id = actor_id
+                        if profiler is None:
+                                a.step()
+                        else:
+                                profiler.step_actor(a)
+                while woken:
+                        self._step_woken(*heapq.heappop(woken))
+                self._stepping = False
+
+                self._apply_pending()
+                self.publish_changes()
+
+        def _apply_pending(self):
+                ''' put on or take off the stage the actors queued while
+                stepping, in the order it happened
+                '''
+                pending = self._pending
+                self._pending = []
+                for actor, add in pending:
+                        if add:
+                                self._add(actor)
+                        else:
+                                self._remove(actor)
+
+        def set_profiler(self, profiler):
+                ''' time the actors' steps with profiler (see wwprofile.py),
+                or stop with None
+                '''
+                self._profiler = profiler
+
+        def get_profiler(self):
+                return self._profiler
 
-                for a in self._actors:
-                        a.step()
+        def subscribe(self, callback):
+                ''' call callback(stage, changes) with the Change_Set of every
+                step, after the step
+                '''
+                self._subscribers.append(callback)
+
+        def unsubscribe(self, callback):
+                self._subscribers.remove(callback)
+
+        def get_changes(self):
+                ''' return the changes since they were last published '''
+                return self._changes
+
+        def publish_changes(self):
+                ''' pass the changes since they were last published to every
+                subscriber, then start a new change set. Every step does this,
+                call it to publish changes made between steps early.
+                '''
+                for callback in self._subscribers:
+                        callback(self, self._changes)
+                self._changes.clear()
+
+        def _step_woken(self, actor_id, actor):
+                if self._actors.get(actor_id) is not actor: #gone
+                        return
+                self._stepping_id = actor_id
+                if self._profiler is None:
+                        actor.step()
+                else:
+                        self._profiler.step_actor(actor)
+                if self._waits(actor):
+                        self._rest(actor)
+
+        def run(self, max_ticks=None):
+                ''' step self as fast as possible until the game is over or
+                max_ticks steps have been taken, return the number of steps.
+                There is no frame delay, this is meant for headless stages.
+                '''
+                ticks = 0
+                while not self.game_over():
+                        if max_ticks is not None and ticks >= max_ticks:
+                                break
+                        self.step()
+                        ticks += 1
+                return ticks
 
         def get_actors(self):
-                return self._actors
+                return list(self._actors.values())
+
+        def get_actor_by_id(self, actor_id):
+                return self._actors.get(actor_id)
+
+        def get_actors_in(self, x, y, columns, rows):
+                ''' return the actors in the rectangle of cells columns wide
+                and rows high with (x, y) at its top left, looking up only
+                the cells in it
+                '''
+                cells = self._cells
+                found = []
+                for j in range(max(y, 0), min(y + rows, self._height)):
+                        for i in range(max(x, 0), min(x + columns,
+                                                      self._width)):
+                                actors = cells.get((i, j))
+                                if actors is not None:
+                                        found.extend(actors)
+                return found
 
         def get_actor(self, x, y):
                 ''' return the first actor at coordinates (x,y) 
                 return None if there is no such actor
                 '''
-                for a in self._actors:
-                        if a.get_position()==(x,y):
-                                return a
-                return None
+                actors = self._cells.get((x,y))
+                if actors is None:
+                        return None
+                return actors[0]
         
         def game_over(self):
-                
-                if self._player1 != None or self._player2 != None:
-
-                        for a in self._actors:
-                                if isinstance(a, Monster):
-                                        return False
-                                
+                ''' whether the game is over: every player is gone, or every
+                monster is (and the players won)
+                '''
+                if self._players:
+                        if self._monster_count > 0:
+                                return False
                         self._is_winner = True
                         return True
                 
                 return True
                 
+        def add_camera(self, camera):
+                ''' draw the view of camera instead of the whole stage '''
+                self._cameras.append(camera)
+
+        def get_cameras(self):
+                return self._cameras
+
+        def split_screen(self, player_numbers=None):
+                ''' replace the cameras with one per player (each player on
+                self by default), side by side across the screen, each
+                following its player
+                '''
+                if player_numbers is None:
+                        player_numbers = [p.get_player_number()
+                                          for p in self.get_players()]
+                (width, height) = self._screen.get_size()
+                self._cameras = []
+                for n, player_number in enumerate(player_numbers):
+                        left = width * n // len(player_numbers)
+                        right = width * (n+1) // len(player_numbers)
+                        self.add_camera(Camera(self, (left, 0, right - left,
+                                                      height),
+                                               player_number))
+
         def draw(self):
-                ''' draw all Actors on self to the screen '''
+                ''' draw all Actors on self to the screen. Only the cells that
+                changed since the last draw are redrawn and pushed to the
+                display, unless the background colour changed where it can
+                be seen (not under an opaque stage picture), then the whole
+                stage is redrawn. With cameras, each camera's view is drawn
+                instead, following its player.
+                '''
+                if self._headless:
+                        return
                 #colour the stage with the appropriate configuration (r,g,b),
                 #(holding g and b at the same colour gives a shade of turquoise)
-                self._screen.fill((0, self._colour, self._colour))
-                self._screen.blit(self._stage_pic, (0,0))
-
-                #self._colour must be oscillate between 0 and 75
-                if self._colour == 75:
-                        self._colour_change = -5
-                elif self._colour == 0:
-                        self._colour_change = 5
+                colour = (0, self._colour, self._colour)
+                if self._cameras:
+                        self._draw_cameras(colour)
+                        self._drawn_colour = None #not the whole stage
+                else:
+                        if self._drawn_colour is None or \
+                           (self._colour != self._drawn_colour and
+                            not self._colour_hidden):
+                                self._draw_all(colour)
+                        else:
+                                self._draw_dirty(colour)
+                        self._drawn_colour = self._colour
+
+                #self._colour must be oscillate between 0 and 75, a
+                #colour_change of 0 keeps the background still
+                if self._colour_change != 0:
+                        if self._colour == 75:
+                                self._colour_change = -5
+                        elif self._colour == 0:
+                                self._colour_change = 5
                         
                 #The colour changes by 5 each draw execution
                 self._colour += self._colour_change
+
+        def _draw_all(self, colour):
+                ''' redraw the whole stage '''
+                self._screen.fill(colour)
+                if self._stage_pic is not None:
+                        self._screen.blit(self._stage_pic, (0,0))
+
+                if self._atlas is not None:
+                        self._screen.blits(self.sprites(self._actors.values(),
+                                                        self._cell_rects),
+                                           doreturn=False)
+                        self._dirty.clear()
+                        self._present()
+                        return
                 
-                
-                for a in self._actors:
+                for a in self._actors.values():
                         icon=a.get_icon()
                         (x,y)=a.get_position()
                         d=self._icon_dimension
                         rect=pygame.Rect(x*d, y*d, d, d)
                         self._screen.blit(icon, rect)
-                pygame.display.flip()
-
+                self._dirty.clear()
+                self._present()
+
+        def _draw_cameras(self, colour):
+                ''' redraw the view of every camera '''
+                for camera in self._cameras:
+                        camera.follow()
+                        camera.draw(self._screen, colour, self._stage_pic)
+                self._dirty.clear()
+                self._present()
+
+        def _draw_dirty(self, colour):
+                ''' redraw only the cells that changed since the last draw '''
+                for a in self._animated:
+                        self._dirty.add(a.get_position())
+                if self._atlas is not None:
+                        self._draw_dirty_batched(colour)
+                        return
 
+                d=self._icon_dimension
+                rects = []
+                for (x,y) in self._dirty:
+                        rect=pygame.Rect(x*d, y*d, d, d)
+                        self._screen.fill(colour, rect)
+                        if self._stage_pic is not None:
+                                self._screen.blit(self._stage_pic, rect, rect)
+                        for a in self._cells.get((x,y), ()):
+                                self._screen.blit(a.get_icon(), rect)
+                        rects.append(rect)
+                self._dirty.clear()
+                self._present(rects)
+
+        def _draw_dirty_batched(self, colour):
+                ''' _draw_dirty from the atlas: the changed cells are cleared,
+                then their background and actors drawn in one batch (an icon
+                stays in its cell, so the order between cells does not
+                matter)
+                '''
+                cell_rects = self._cell_rects
+                d = self._icon_dimension
+                rects = []
+                actors = []
+                for cell in self._dirty:
+                        rect = cell_rects.get(cell)
+                        if rect is None:
+                                rect = cell_rects[cell] = pygame.Rect(
+                                        cell[0]*d, cell[1]*d, d, d)
+                        self._screen.fill(colour, rect)
+                        rects.append(rect)
+                        actors.extend(self._cells.get(cell, ()))
+                batch = []
+                if self._stage_pic is not None:
+                        pic = self._stage_pic
+                        batch = [(pic, rect, rect) for rect in rects]
+                batch.extend(self.sprites(actors, cell_rects))
+                self._screen.blits(batch, doreturn=False)
+                self._dirty.clear()
+                self._present(rects)
+
+        def _present(self, rects=None):
+                ''' push what was drawn to the display, only rects of it
+                when given
+                '''
+                if not self._on_display:
+                        return
+                if rects is None:
+                        pygame.display.flip()
+                else:
+                        pygame.display.update(rects)
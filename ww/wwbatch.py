@@ -0,0 +1,146 @@
+''' Runs many seeded headless games of a level with scripted players on a
+pool of processes, to see how a level plays out. Each game's result is
+written as one JSON object per line as soon as it finishes, and a summary
+(win rate, ticks to finish, monster evolutions and player deaths) is
+printed at the end, for example
+
+        python wwbatch.py --games 10000 --players 2 --output games.jsonl
+
+The scripted players press a random one of their movement keys, with the
+chance --move-chance each step. Game n uses seed --seed + n, for building
+the level and for its players, so any game can be run again on its own.
+'''
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import time
+
+from ww import *
+import wwlevels
+
+LEVELS = {"classic": wwlevels.classic_level,
+          "generated": wwlevels.generated_level}
+
+def play(seed, level="classic", players=1, max_ticks=2000,
+         move_chance=0.5):
+        ''' play one headless game, returning its result as a dict '''
+        rng = random.Random(seed)
+        stage = Stage(20, 20, 24, None, headless=True)
+        LEVELS[level](stage, players, rng)
+        keys = [PLAYER_KEYS[n] for n in range(1, players + 1)]
+
+        ticks = 0
+        while not stage.game_over() and ticks < max_ticks:
+                for player_keys in keys:
+                        if rng.random() < move_chance:
+                                stage.player_event(rng.choice(player_keys))
+                stage.step()
+                ticks += 1
+
+        monsters = 0
+        for a in stage.get_actors():
+                if isinstance(a, Monster):
+                        monsters += 1
+        return {"seed": seed, "level": level, "players": players,
+                "winner": stage.is_winner(), "finished": stage.game_over(),
+                "ticks": ticks, "evolutions": stage.get_evolution_count(),
+                "player_deaths": stage.get_player_death_count(),
+                "monsters_left": monsters}
+
+def play_batch(seeds, level, players, max_ticks, move_chance):
+        ''' play a game for each seed, in a worker process '''
+        return [play(seed, level, players, max_ticks, move_chance)
+                for seed in seeds]
+
+class Summary:
+        ''' Running totals of game results '''
+
+        def __init__(self):
+                self._games = 0
+                self._wins = 0
+                self._finished = 0
+                self._ticks = [] #ticks taken by each finished game
+                self._evolutions = 0
+                self._player_deaths = 0
+
+        def add(self, result):
+                self._games += 1
+                self._wins += result["winner"]
+                if result["finished"]:
+                        self._finished += 1
+                        self._ticks.append(result["ticks"])
+                self._evolutions += result["evolutions"]
+                self._player_deaths += result["player_deaths"]
+
+        def report(self):
+                games = max(self._games, 1)
+                ticks = sorted(self._ticks)
+                return {"games": self._games,
+                        "win_rate": self._wins / float(games),
+                        "finished": self._finished,
+                        "mean_ticks": sum(ticks) / float(len(ticks))
+                                      if ticks else None,
+                        "median_ticks": ticks[len(ticks) // 2]
+                                        if ticks else None,
+                        "evolutions_per_game": self._evolutions / float(games),
+                        "player_deaths_per_game":
+                                self._player_deaths / float(games)}
+
+def run(games, seed=0, level="classic", players=1, max_ticks=2000,
+        move_chance=0.5, workers=None, batch=20, output=None):
+        ''' play games seeded seed, seed+1, ... on workers processes (all
+        cores by default), in batches of batch games per task. Each result
+        is written to output as it comes in. Returns the Summary.
+        '''
+        summary = Summary()
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                futures = [pool.submit(play_batch,
+                                       range(start, min(start + batch,
+                                                        seed + games)),
+                                       level, players, max_ticks, move_chance)
+                           for start in range(seed, seed + games, batch)]
+                for future in concurrent.futures.as_completed(futures):
+                        for result in future.result():
+                                summary.add(result)
+                                if output is not None:
+                                        output.write(json.dumps(result) + "\n")
+                        if output is not None:
+                                output.flush()
+        return summary
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description="Play seeded headless "
+                                         "warehouse wars games in parallel.")
+        parser.add_argument("--games", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0,
+                            help="seed of the first game")
+        parser.add_argument("--level", default="classic")
+        parser.add_argument("--players", type=int, choices=(1, 2), default=1)
+        parser.add_argument("--max-ticks", type=int, default=2000,
+                            help="give up on a game after this many steps")
+        parser.add_argument("--move-chance", type=float, default=0.5)
+        parser.add_argument("--workers", type=int,
+                            help="processes to use (default: all cores)")
+        parser.add_argument("--batch", type=int, default=20,
+                            help="games per task sent to a process")
+        parser.add_argument("--output", help="append results to this file")
+        args = parser.parse_args(argv)
+        if args.level not in LEVELS:
+                parser.error("unknown level %r" % args.level)
+
+        output = open(args.output, "a") if args.output else None
+        start = time.perf_counter()
+        summary = run(args.games, args.seed, args.level, args.players,
+                      args.max_ticks, args.move_chance, args.workers,
+                      args.batch, output)
+        if output is not None:
+                output.close()
+        report = summary.report()
+        report["seconds"] = time.perf_counter() - start
+        report["workers"] = args.workers or os.cpu_count()
+        print(json.dumps(report))
+
+if __name__ == "__main__":
+        main()
@@ -0,0 +1,301 @@
+''' Benchmarks for the warehouse wars engine. Every benchmark prints one JSON
+object per line so runs can be saved and compared, for example
+
+        python wwbench.py step --sizes 20 100 500 --output bench.jsonl
+        python wwbench.py get_actor draw
+        python wwbench.py memory --count 100000
+        python wwbench.py step --profile
+        python wwbench.py draw --sizes 20 100
+
+With --profile the step and draw benchmarks run with a Tick_Profiler (see
+wwprofile.py) attached and add its report to their results, which times the
+phases and the actor classes of every tick but slows the runs a little.
+
+The draw benchmark times every stage twice, blitting each actor's icon on
+its own and then in batches from a Sprite_Atlas, and gives the speedup of
+the atlas.
+
+Stages are built from a seed, so the same arguments always time the same
+boards.
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+#draw offscreen, even without a display
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+from ww import *
+import wwprofile
+
+SIZES = [20, 50, 100, 200, 500]
+DENSITIES = [0.1, 0.3]
+DRAW_PIXELS = 5000 #largest stage side in pixels drawn whole
+CAMERA_PIXELS = 480 #side of the window the camera draw benchmark uses
+
+#monster classes and icons, in the mix placed on benchmark stages
+MONSTERS = [(Monster, "icons/Monsters/white_monster.png"),
+            (Shy_Monster, "icons/Monsters/purple_monster.png"),
+            (Stalker_Monster, "icons/Monsters/yellow_monster.png"),
+            (Fire_Monster, "icons/Monsters/red_monster.png"),
+            (Ice_Monster, "icons/Monsters/dark_blue_monster.png"),
+            (Earth_Monster, "icons/Monsters/green_monster.png")]
+MONSTER_DENSITY = 0.02 #fraction of cells holding a monster
+
+def build_stage(size, density, seed, surface=None):
+        ''' return a size x size stage with one player at (0,0), a density
+        fraction of its cells holding boxes and MONSTER_DENSITY of them a
+        mix of every monster class. Headless unless surface is given.
+        '''
+        rng = random.Random(seed)
+        stage = Stage(size, size, 24, load_icon("icons/Screens/stage.png")
+                      if surface is not None else None,
+                      headless=surface is None, surface=surface)
+        stage.set_player(KeyboardPlayer("icons/Players/player1.png", stage,
+                                        0, 0))
+        cells = rng.sample(range(1, size * size),
+                           int(size * size * (density + MONSTER_DENSITY)))
+        monsters = int(size * size * MONSTER_DENSITY)
+        for n, cell in enumerate(cells):
+                (x, y) = (cell % size, cell // size)
+                if n < monsters:
+                        cls, icon = MONSTERS[n % len(MONSTERS)]
+                        if cls is Shy_Monster:
+                                monster = cls(icon, "icons/Boxes/monster_"
+                                              "disguise.png", stage, x, y)
+                        else:
+                                monster = cls(icon, stage, x, y,
+                                              rng.randrange(1, 6))
+                        monster.set_direction(rng.choice((-1, 1)),
+                                              rng.choice((-1, 1)))
+                        stage.add_actor(monster)
+                else:
+                        stage.add_actor(Box("icons/Boxes/black_box.png",
+                                            stage, x, y))
+        return stage
+
+def _result(benchmark, size, density, value, unit, **extra):
+        result = {"benchmark": benchmark, "size": size, "density": density,
+                  "value": value, "unit": unit}
+        result.update(extra)
+        return result
+
+def _profile(stage, profile):
+        ''' return a Tick_Profiler attached to stage when profile is true,
+        else None
+        '''
+        if profile:
+                return wwprofile.Tick_Profiler(stage)
+        return None
+
+def _profiled(result, profiler):
+        if profiler is not None:
+                result["profile"] = profiler.report()
+        return result
+
+def bench_step(sizes, densities, ticks, seed, profile=False):
+        ''' ticks per second of Stage.step '''
+        for size in sizes:
+                for density in densities:
+                        stage = build_stage(size, density, seed)
+                        profiler = _profile(stage, profile)
+                        start = time.perf_counter()
+                        for tick in range(ticks):
+                                stage.step()
+                        elapsed = time.perf_counter() - start
+                        yield _profiled(_result("step", size, density,
+                                                ticks / elapsed, "ticks/s",
+                                                ticks=ticks,
+                                                actors=len(stage.get_actors())),
+                                        profiler)
+
+def bench_get_actor(sizes, densities, lookups, seed):
+        ''' lookups per second of Stage.get_actor at random cells '''
+        for size in sizes:
+                for density in densities:
+                        stage = build_stage(size, density, seed)
+                        rng = random.Random(seed)
+                        cells = [(rng.randrange(size), rng.randrange(size))
+                                 for i in range(lookups)]
+                        get_actor = stage.get_actor
+                        start = time.perf_counter()
+                        for (x, y) in cells:
+                                get_actor(x, y)
+                        elapsed = time.perf_counter() - start
+                        yield _result("get_actor", size, density,
+                                      lookups / elapsed, "lookups/s",
+                                      lookups=lookups)
+
+def bench_draw(sizes, densities, frames, seed, profile=False):
+        ''' frames per second of Stage.draw onto an offscreen surface, with
+        the colour pulse (a full redraw every frame), with a still background
+        (only cells changed by a step between frames) and through a camera
+        following the player in a CAMERA_PIXELS square window, which is the
+        only mode tried on stages larger than DRAW_PIXELS. Each is drawn
+        blitting actors one at a time and then from a Sprite_Atlas.
+        '''
+        pygame.display.init()
+        pygame.display.set_mode((1, 1)) #so icons are converted
+        atlas = Sprite_Atlas()
+        for size in sizes:
+                modes = ["camera"]
+                if size * 24 <= DRAW_PIXELS:
+                        modes = ["full", "incremental"] + modes
+                for density in densities:
+                        for mode in modes:
+                                if mode == "camera":
+                                        surface = pygame.Surface(
+                                                (CAMERA_PIXELS, CAMERA_PIXELS))
+                                else:
+                                        surface = pygame.Surface(
+                                                (size * 24, size * 24))
+                                blit_fps = None
+                                for renderer in ("blit", "atlas"):
+                                        stage = build_stage(size, density,
+                                                            seed, surface)
+                                        if renderer == "atlas":
+                                                stage.set_atlas(atlas)
+                                        fps = _frames_per_second(
+                                                stage, mode, frames, profile)
+                                        result = _result(
+                                                "draw", size, density,
+                                                fps, "frames/s",
+                                                frames=frames, mode=mode,
+                                                renderer=renderer)
+                                        if blit_fps is None:
+                                                blit_fps = fps
+                                        else:
+                                                result["speedup"] = \
+                                                        fps / blit_fps
+                                        yield _profiled(result,
+                                                        stage.get_profiler())
+
+def _frames_per_second(stage, mode, frames, profile):
+        ''' draw stage frames times in mode, stepping it between draws,
+        return the draws per second
+        '''
+        if mode == "incremental":
+                stage.set_colour_change(0)
+        elif mode == "camera":
+                stage.split_screen()
+        stage.draw()
+        _profile(stage, profile)
+        elapsed = 0.0
+        for frame in range(frames):
+                stage.step()
+                start = time.perf_counter()
+                stage.draw()
+                elapsed += time.perf_counter() - start
+        return frames / elapsed
+
+class _Dict_Box:
+        ''' A Box laid out the way actors were before they had __slots__, a
+        plain object with an instance __dict__, to compare against
+        '''
+        def __init__(self, icon_file, stage, x, y, delay=5):
+                self._icon_file = icon_file
+                self._icon = None
+                self._stage = stage
+                (self._x, self._y) = (x, y)
+                self._delay = delay
+                self._delay_count = 0
+                self._is_dead = False
+                self._id = None
+
+def _bytes_per_object(make, count):
+        ''' return the bytes allocated per object by count calls of make '''
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [make(i) for i in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        #do not count the list holding the objects
+        return (after - before - sys.getsizeof(objects)) / float(count)
+
+def bench_memory(count):
+        ''' bytes per actor for actors with an instance __dict__ (before)
+        and with __slots__ (after), and per Box put on a stage
+        '''
+        stage = Stage(1000, 1000, 24, None, headless=True)
+        icon = "icons/Boxes/black_box.png"
+        width = stage.get_width()
+
+        def on_stage(i):
+                box = Box(icon, stage, i % width, i // width % width)
+                stage.add_actor(box)
+                return box
+
+        yield {"benchmark": "memory", "actor": "Box (__dict__)",
+               "count": count, "bytes_per_actor": _bytes_per_object(
+                       lambda i: _Dict_Box(icon, stage, i, i), count)}
+        for cls in (Box, Monster):
+                yield {"benchmark": "memory", "actor": cls.__name__,
+                       "count": count, "bytes_per_actor": _bytes_per_object(
+                               lambda i: cls(icon, stage, i, i), count)}
+        yield {"benchmark": "memory", "actor": "Box on a stage",
+               "count": count,
+               "bytes_per_actor": _bytes_per_object(on_stage, count)}
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+        parser.add_argument("benchmarks", nargs="*",
+                            help="any of step, get_actor, draw and memory "
+                                 "(default: step get_actor draw)")
+        parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+        parser.add_argument("--densities", type=float, nargs="+",
+                            default=DENSITIES)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--ticks", type=int, default=50)
+        parser.add_argument("--lookups", type=int, default=200000)
+        parser.add_argument("--frames", type=int, default=30)
+        parser.add_argument("--count", type=int, default=100000,
+                            help="actors created by the memory benchmark")
+        parser.add_argument("--output", help="append results to this file")
+        parser.add_argument("--profile", action="store_true",
+                            help="add a tick profile to the step and draw "
+                                 "results")
+        args = parser.parse_args(argv)
+        benchmarks = args.benchmarks or ["step", "get_actor", "draw"]
+        for benchmark in benchmarks:
+                if benchmark not in ("step", "get_actor", "draw", "memory"):
+                        parser.error("unknown benchmark %r" % benchmark)
+
+        #icon paths are relative to the game directory, the output path to
+        #where it was run from
+        if args.output:
+                args.output = os.path.abspath(args.output)
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        run = {"python": platform.python_version(),
+               "pygame": pygame.version.ver, "seed": args.seed,
+               "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+        output = open(args.output, "a") if args.output else sys.stdout
+        for benchmark in benchmarks:
+                if benchmark == "step":
+                        results = bench_step(args.sizes, args.densities,
+                                             args.ticks, args.seed,
+                                             args.profile)
+                elif benchmark == "get_actor":
+                        results = bench_get_actor(args.sizes, args.densities,
+                                                  args.lookups, args.seed)
+                elif benchmark == "draw":
+                        results = bench_draw(args.sizes, args.densities,
+                                             args.frames, args.seed,
+                                             args.profile)
+                else:
+                        results = bench_memory(args.count)
+                for result in results:
+                        result.update(run)
+                        output.write(json.dumps(result) + "\n")
+                        output.flush()
+        if output is not sys.stdout:
+                output.close()
+
+if __name__ == "__main__":
+        main()
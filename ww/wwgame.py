@@ -1,10 +1,25 @@
 import sys, pygame, random
 from ww import *
+from wwlevels import classic_level
+from wwreplay import Recorder
 pygame.init()
 
+#usage: python wwgame.py [seed [replay file]], the same seed places the same
+#boxes, and a replay file records the game for wwreplay.py
+#(WW_PROFILE=1 python wwgame.py prints where the time of each step and
+#draw went when the game ends, see wwprofile.py)
+seed = int(sys.argv[1]) if len(sys.argv) > 1 else random.randrange(2**32)
+record_file = sys.argv[2] if len(sys.argv) > 2 else None
+random.seed(seed)
+
+TICK_RATE = 10 #simulation steps per second
+FRAME_CAP = 60 #most frames (input polls) per second
+MAX_STEPS_PER_FRAME = 5 #most steps taken to catch up before giving up
+
 #Start Screen
 screen = pygame.display.set_mode((442,700))
-start_screen = pygame.image.load("icons/Screens/start_screen.png")
+preload_icons() #decode every icon once, up front
+start_screen = load_icon("icons/Screens/start_screen.png")
 player_option = 0
 colour=0 #starting colour of stage
 
@@ -30,65 +45,61 @@ while player_option == 0:
         pygame.display.flip()                    
 
 
-ww=Stage(20, 20, 24, pygame.image.load("icons/Screens/stage.png"))
-
-if player_option == 1:
-        ww.set_player(KeyboardPlayer("icons/Players/player1.png", ww, 0, 0))
-        
-elif player_option == 2:
-        ww.set_player(KeyboardPlayer("icons/Players/player1.png", ww, 0, 0, 1),
-                       KeyboardPlayer("icons/Players/player2.png", ww, 0, 1, 2))
-
-#Generate a safe spawn zone (diagonal with player 1 to exit)      
-ww.add_actor(Wall("icons/Boxes/immovable_box.png", ww, 2, 0))
-ww.add_actor(Wall("icons/Boxes/immovable_box.png", ww, 2, 1))
-ww.add_actor(Wall("icons/Boxes/immovable_box.png", ww, 1, 2))
-ww.add_actor(Wall("icons/Boxes/immovable_box.png", ww, 0, 2))
-
+#a still background: the pulse shows through the lines of stage.png, so
+#it would have every frame redraw the whole stage
+ww=Stage(20, 20, 24, load_icon("icons/Screens/stage.png"), colour_change=0)
+ww.set_atlas(Sprite_Atlas()) #draw the actors in one batch a frame
 
-ww.add_actor(Monster("icons/Monsters/white_monster.png", ww, 1, 19, 1))
+classic_level(ww, player_option)
 
-ww.add_actor(Shy_Monster("icons/Monsters/purple_monster.png",
-                               "icons/Boxes/monster_disguise.png", ww, 18, 1))
-
-ww.add_actor(Fire_Monster("icons/Monsters/red_monster.png", ww, 4, 16, 4))
-ww.add_actor(Earth_Monster("icons/Monsters/green_monster.png", ww, 10, 17, 3))
-ww.add_actor(Ice_Monster("icons/Monsters/dark_blue_monster.png", ww, 17, 18, 6))
-
-
-
-#plot 100 boxes in places where there are not actors already
-num_boxes=0
-while num_boxes<100:
-        x=random.randrange(ww.get_width())
-        y=random.randrange(ww.get_height())
-        if ww.get_actor(x,y) is None:
-                ww.add_actor(Box("icons/Boxes/black_box.png", ww, x, y))
-                num_boxes+=1
+recorder = Recorder(ww, seed)
 
+def quit_game():
+        if record_file is not None:
+                recorder.save(record_file)
+        sys.exit()
 
 # while the game is not over, quit or pass an event to the player, then
-# allow all actors to take a step and re-draw the stage
+# allow all actors to take a step and re-draw the stage. The stage steps at
+# a fixed TICK_RATE whatever the frame rate, taking several steps per draw
+# to catch up when frames run long (skipping the frames in between)
+clock = pygame.time.Clock()
+tick_length = 1000.0 / TICK_RATE #milliseconds per step
+lag = 0.0 #milliseconds of simulation still to run
+
 while not ww.game_over():
-        pygame.time.wait(100)
+        lag += clock.tick(FRAME_CAP)
         for event in pygame.event.get():
-                if event.type == pygame.QUIT: sys.exit()
+                if event.type == pygame.QUIT: quit_game()
                 if event.type == pygame.KEYDOWN:
-                        ww.player_event(event.key)                    
-        ww.step()
-        ww.draw()
+                        recorder.player_event(event.key)
+
+        steps = 0
+        while lag >= tick_length and steps < MAX_STEPS_PER_FRAME:
+                recorder.step()
+                lag -= tick_length
+                steps += 1
+                if ww.game_over():
+                        break
+
+        if lag >= tick_length:
+                #too far behind to catch up, drop the time instead of
+                #spiralling
+                lag = 0.0
+        if steps > 0:
+                ww.draw()
 
 #When the game is over display the game over screen
 screen = pygame.display.set_mode((480,700))
 
 if ww.is_winner():
-        end_screen = pygame.image.load("icons/Screens/Winner.png")
+        end_screen = load_icon("icons/Screens/Winner.png")
         
 if not ww.is_winner():
-        end_screen = pygame.image.load("icons/Screens/Game_Over.png")
+        end_screen = load_icon("icons/Screens/Game_Over.png")
         
 screen.blit(end_screen, (0,0))
 pygame.display.flip()
-sys.exit()
+quit_game()
 
 
@@ -0,0 +1,264 @@
+''' Levels to play warehouse wars on. A level function puts players, walls,
+monsters and boxes onto an empty stage, drawing any randomness from rng
+(the random module or a random.Random), so a seeded rng always builds the
+same level.
+
+generated_level builds a new random level for a stage of any size from a
+seed: walls and boxes at a given density and monsters kept away from the
+players. Its layouts are made in time linear in the size of the stage (the
+small ones cached by seed) and only kept when is_playable finds that the
+players can reach every monster with enough boxes to trap them, so
+thousands can be made up front:
+
+        layouts = list(playable_layouts(1000, 30, 20, density=0.3))
+        build_level(stage, layouts[0])
+'''
+import collections
+import functools
+import random
+
+from ww import *
+
+WALL_ICON = "icons/Boxes/immovable_box.png"
+BOX_ICON = "icons/Boxes/black_box.png"
+PLAYER_ICONS = ["icons/Players/player1.png", "icons/Players/player2.png"]
+
+# the monsters of a generated level, in turn: (class, icon, delay)
+MONSTER_KINDS = [(Monster, "icons/Monsters/white_monster.png", 1),
+                 (Shy_Monster, "icons/Monsters/purple_monster.png", 5),
+                 (Fire_Monster, "icons/Monsters/red_monster.png", 4),
+                 (Earth_Monster, "icons/Monsters/green_monster.png", 3),
+                 (Ice_Monster, "icons/Monsters/dark_blue_monster.png", 6)]
+SHY_DISGUISE = "icons/Boxes/monster_disguise.png"
+
+# the safe spawn zone in the top left corner: the players' cells, the walls
+# around them and the diagonal way out, kept clear of boxes
+SPAWN_CELLS = [(0, 0), (1, 0), (0, 1), (1, 1)]
+PLAYER_CELLS = [(0, 0), (0, 1)] #players 1 and 2
+SPAWN_WALLS = [(2, 0), (2, 1), (1, 2), (0, 2)]
+SPAWN_EXIT = (2, 2)
+
+SAFE_DISTANCE = 6 #monsters start at least this many steps from the spawn
+TRAP_BOXES = 3 #boxes it takes to trap a monster in a corner, the fewest
+LAYOUT_CACHE = 1024 #layouts generate_layout keeps
+CACHED_AREA = 1024 #cells in the largest layout kept, a big one is made again
+MAX_TRIES = 1000 #seeds tried for a playable layout before giving up
+
+def classic_level(stage, players=1, rng=random, boxes=100):
+        ''' the level of wwgame.py: one or two players (or none, to add
+        later) in the top left corner behind a diagonal of walls, one monster
+        of each kind and boxes in random empty places
+        '''
+        if players == 1:
+                stage.set_player(KeyboardPlayer("icons/Players/player1.png",
+                                                stage, 0, 0))
+        elif players == 2:
+                stage.set_player(KeyboardPlayer("icons/Players/player1.png",
+                                                stage, 0, 0, 1),
+                                 KeyboardPlayer("icons/Players/player2.png",
+                                                stage, 0, 1, 2))
+
+        #Generate a safe spawn zone (diagonal with player 1 to exit)
+        stage.add_actor(Wall("icons/Boxes/immovable_box.png", stage, 2, 0))
+        stage.add_actor(Wall("icons/Boxes/immovable_box.png", stage, 2, 1))
+        stage.add_actor(Wall("icons/Boxes/immovable_box.png", stage, 1, 2))
+        stage.add_actor(Wall("icons/Boxes/immovable_box.png", stage, 0, 2))
+
+        stage.add_actor(Monster("icons/Monsters/white_monster.png", stage,
+                                1, 19, 1))
+        stage.add_actor(Shy_Monster("icons/Monsters/purple_monster.png",
+                                    "icons/Boxes/monster_disguise.png",
+                                    stage, 18, 1))
+        stage.add_actor(Fire_Monster("icons/Monsters/red_monster.png", stage,
+                                     4, 16, 4))
+        stage.add_actor(Earth_Monster("icons/Monsters/green_monster.png",
+                                      stage, 10, 17, 3))
+        stage.add_actor(Ice_Monster("icons/Monsters/dark_blue_monster.png",
+                                    stage, 17, 18, 6))
+
+        #plot boxes in places where there are not actors already
+        num_boxes = 0
+        while num_boxes < boxes:
+                x = rng.randrange(stage.get_width())
+                y = rng.randrange(stage.get_height())
+                if stage.get_actor(x, y) is None:
+                        stage.add_actor(Box("icons/Boxes/black_box.png",
+                                            stage, x, y))
+                        num_boxes += 1
+
+class Level_Layout:
+        ''' Where the actors of a generated level go, independent of any
+        stage: wall, box and monster cells (monsters as (kind, x, y), kind
+        an index into MONSTER_KINDS)
+        '''
+
+        def __init__(self, width, height, seed, walls, boxes, monsters):
+                self._width = width
+                self._height = height
+                self._seed = seed
+                self._walls = walls
+                self._boxes = boxes
+                self._monsters = monsters
+
+        def get_width(self):
+                return self._width
+
+        def get_height(self):
+                return self._height
+
+        def get_seed(self):
+                return self._seed
+
+        def get_walls(self):
+                return self._walls
+
+        def get_boxes(self):
+                return self._boxes
+
+        def get_monsters(self):
+                return self._monsters
+
+def generate_layout(width, height, seed, density=0.25, monsters=5,
+                    wall_density=0.0):
+        ''' return the Level_Layout seeded seed for a width by height stage:
+        the spawn zone in the top left corner, then of the cells left a
+        fraction wall_density of walls and density of boxes, and monsters at
+        least SAFE_DISTANCE from the spawn (anywhere when the stage is too
+        small for that). Every cell is picked once, by sampling without
+        replacement, so the time taken is linear in the stage's area.
+        Layouts of up to CACHED_AREA cells are cached.
+        '''
+        if width * height <= CACHED_AREA:
+                return _cached_layout(width, height, seed, density, monsters,
+                                      wall_density)
+        return _make_layout(width, height, seed, density, monsters,
+                            wall_density)
+
+def _make_layout(width, height, seed, density, monsters, wall_density):
+        if width < 4 or height < 4:
+                raise ValueError("a generated level needs at least 4x4 cells")
+        rng = random.Random(seed)
+        reserved = set(SPAWN_CELLS + SPAWN_WALLS)
+        reserved.add(SPAWN_EXIT)
+        free = [(x, y) for y in range(height) for x in range(width)
+                if (x, y) not in reserved]
+
+        far = [cell for cell in free if max(cell) >= SAFE_DISTANCE]
+        if len(far) < monsters:
+                far = free
+        if len(far) < monsters:
+                raise ValueError("no room for %d monsters" % monsters)
+        monster_cells = rng.sample(far, monsters)
+        taken = set(monster_cells)
+        free = [cell for cell in free if cell not in taken]
+
+        wall_count = min(int(len(free) * wall_density), len(free))
+        box_count = min(int(len(free) * density), len(free) - wall_count)
+        picked = rng.sample(free, wall_count + box_count)
+        return Level_Layout(width, height, seed,
+                            tuple(SPAWN_WALLS) + tuple(picked[:wall_count]),
+                            tuple(picked[wall_count:]),
+                            tuple((n % len(MONSTER_KINDS), x, y) for n, (x, y)
+                                  in enumerate(monster_cells)))
+
+_cached_layout = functools.lru_cache(maxsize=LAYOUT_CACHE)(_make_layout)
+
+def reachable_cells(layout, start=(0, 0)):
+        ''' return a bytearray, one byte per cell in rows, set for the cells
+        a player at start can reach moving in any of the 8 directions
+        through anything but walls (boxes may be pushed out of the way, and
+        monsters move)
+        '''
+        width, height = layout.get_width(), layout.get_height()
+        seen = bytearray(width * height)
+        for (x, y) in layout.get_walls():
+                seen[y*width + x] = 1 #never entered
+        (x, y) = start
+        reached = bytearray(width * height)
+        seen[y*width + x] = reached[y*width + x] = 1
+        frontier = collections.deque([start])
+        while frontier:
+                (x, y) = frontier.popleft()
+                for (dx, dy) in DIRECTIONS:
+                        (nx, ny) = (x + dx, y + dy)
+                        if 0 <= nx < width and 0 <= ny < height and \
+                           not seen[ny*width + nx]:
+                                seen[ny*width + nx] = reached[ny*width + nx] = 1
+                                frontier.append((nx, ny))
+        return reached
+
+def is_playable(layout):
+        ''' a quick check that layout can be won: from the spawn the players
+        can reach every monster, and reach at least TRAP_BOXES boxes for each
+        of them. It can pass levels that turn out to be too hard, never ones
+        where a monster is walled off
+        '''
+        width = layout.get_width()
+        reached = reachable_cells(layout)
+        for (kind, x, y) in layout.get_monsters():
+                if not reached[y*width + x]:
+                        return False
+        boxes = 0
+        for (x, y) in layout.get_boxes():
+                boxes += reached[y*width + x]
+        return boxes >= TRAP_BOXES * len(layout.get_monsters())
+
+def playable_layouts(count, width, height, density=0.25, monsters=5,
+                     wall_density=0.0, seed=0, max_tries=MAX_TRIES):
+        ''' yield count playable layouts, trying seeds seed, seed+1, ... in
+        turn (so the same arguments give the same layouts). Raises
+        ValueError when max_tries seeds in a row give no playable layout,
+        as they never will for some sizes and densities
+        '''
+        tries = 0
+        while count > 0:
+                layout = generate_layout(width, height, seed, density,
+                                         monsters, wall_density)
+                if is_playable(layout):
+                        yield layout
+                        count -= 1
+                        tries = 0
+                else:
+                        tries += 1
+                        if tries == max_tries:
+                                raise ValueError(
+                                        "no playable %dx%d layout in %d "
+                                        "seeds from %d" % (width, height,
+                                        max_tries, seed - max_tries + 1))
+                seed += 1
+
+def build_level(stage, layout, players=1):
+        ''' put layout onto an empty stage of its size with one or two
+        players (or none, to add later) in the spawn zone
+        '''
+        if (stage.get_width(), stage.get_height()) != \
+           (layout.get_width(), layout.get_height()):
+                raise ValueError("layout is %dx%d, the stage %dx%d" % (
+                        layout.get_width(), layout.get_height(),
+                        stage.get_width(), stage.get_height()))
+        if players:
+                stage.set_player(*[KeyboardPlayer(PLAYER_ICONS[n], stage,
+                                                  PLAYER_CELLS[n][0],
+                                                  PLAYER_CELLS[n][1], n + 1)
+                                   for n in range(players)])
+        for (x, y) in layout.get_walls():
+                stage.add_actor(Wall(WALL_ICON, stage, x, y))
+        for (kind, x, y) in layout.get_monsters():
+                (cls, icon, delay) = MONSTER_KINDS[kind]
+                if cls is Shy_Monster:
+                        stage.add_actor(cls(icon, SHY_DISGUISE, stage, x, y,
+                                            delay))
+                else:
+                        stage.add_actor(cls(icon, stage, x, y, delay))
+        for (x, y) in layout.get_boxes():
+                stage.add_actor(Box(BOX_ICON, stage, x, y))
+
+def generated_level(stage, players=1, rng=random, density=0.25, monsters=5,
+                    wall_density=0.0):
+        ''' a generated level for stage, the first playable layout from a
+        seed drawn from rng
+        '''
+        seed = rng.randrange(2**32)
+        (layout,) = playable_layouts(1, stage.get_width(), stage.get_height(),
+                                     density, monsters, wall_density, seed)
+        build_level(stage, layout, players)
@@ -0,0 +1,365 @@
+''' Stepping very large headless stages on several cores. A Parallel_Stage is
+a Vector_Stage (see wwvector.py) whose arrays live in shared memory, with
+the board split into bands of rows, one worker process stepping each band:
+
+        engine = Parallel_Stage(stage, workers=4)
+        for tick in range(1000):
+                engine.step()
+        engine.sync()
+        engine.close()
+
+Each step goes in three phases. First every worker sorts the movers of its
+band into those that can be stepped alone and the crowded ones, reading two
+rows of the bands either side (its halo) to see the movers there. Then
+every worker steps its lone monsters at once, as Vector_Stage does (none of
+them is within two cells of another mover, so none can see what the others
+do, wherever they are), followed one at a time in stage order by the
+crowded movers of clusters clear of the band's edges, which nothing outside
+the cluster can affect. Last comes the merge, in this process: the crowded
+movers left (near a band's edge, a player or a stack) are stepped one at a
+time in stage order, and the movers that died or froze are put in the order
+Vector_Stage would have them. So the results are the same as
+Vector_Stage.step, and so as Stage.step, whatever the number of workers.
+
+        python wwparallel.py --size 2000 --workers 1 2 4
+'''
+import argparse
+import json
+import multiprocessing
+import multiprocessing.shared_memory
+import os
+import random
+import time
+
+from ww import *
+from wwvector import (EMPTY, ICE, MONSTER, PAD, PLAYER, Vector_Stage,
+                      _AROUND, _NEAR, numpy)
+
+# the arrays of a Vector_Stage put in shared memory: the board grids and
+# the mover arrays, changed in place by the step
+SHARED_ARRAYS = ["_kind", "_first", "_player", "_x", "_y", "_dx", "_dy",
+                 "_delay", "_count", "_is_frozen", "_killed", "_alive"]
+
+HALO = 2 #rows of the bands either side a band reads
+
+class Parallel_Stage(Vector_Stage):
+        ''' A Vector_Stage stepped by a pool of worker processes, one band
+        of rows each (workers defaults to every core)
+        '''
+
+        def __init__(self, stage, workers=None):
+                Vector_Stage.__init__(self, stage)
+                self._workers = workers or os.cpu_count()
+                layout = []
+                size = 0
+                for name in SHARED_ARRAYS:
+                        array = getattr(self, name)
+                        layout.append((name, array.dtype.str, array.shape,
+                                       size))
+                        size += -(-array.nbytes // 8) * 8 #keep them aligned
+                self._memory = multiprocessing.shared_memory.SharedMemory(
+                        create=True, size=max(size, 1))
+                for (name, dtype, shape, offset) in layout:
+                        shared = numpy.ndarray(shape, dtype,
+                                               self._memory.buf, offset)
+                        shared[...] = getattr(self, name)
+                        setattr(self, name, shared)
+
+                height = self._height
+                self._bands = [(height * n // self._workers,
+                                height * (n+1) // self._workers)
+                               for n in range(self._workers)]
+                self._pool = multiprocessing.Pool(
+                        self._workers, _attach,
+                        (self._memory.name, layout, self._width,
+                         self._height))
+
+        def get_workers(self):
+                return self._workers
+
+        def step(self):
+                ''' step every mover once, like Stage.step, the movers of each
+                band in a worker
+                '''
+                sorted_bands = self._pool.map(_sort_band, self._bands)
+
+                #movers sharing a cell are always stepped one at a time, here
+                stacked = numpy.array(sorted(
+                        i for movers in self._stacks.values() for i in movers),
+                        numpy.int64)
+                tasks = []
+                for (band, (alone, crowded, may_write)) in zip(
+                                self._bands, sorted_bands):
+                        in_band = stacked[(self._y[stacked] >= band[0]) &
+                                          (self._y[stacked] < band[1])]
+                        tasks.append((band, numpy.setdiff1d(alone, stacked),
+                                      numpy.union1d(crowded, in_band),
+                                      in_band, may_write))
+
+                #what the workers stepped, in stage order: the lone monsters
+                #first, then the crowded ones, as Vector_Stage steps them
+                alone_leaving = []
+                alone_frozen = []
+                crowded_leaving = []
+                crowded_frozen = []
+                merged = [numpy.flatnonzero(self._alive & self._player &
+                                            self._killed)]
+                for (leaving, frozen, stepped_leaving, stepped_frozen,
+                     rest) in self._pool.map(_step_band, tasks):
+                        alone_leaving.extend(leaving)
+                        alone_frozen.extend(frozen)
+                        crowded_leaving.extend(stepped_leaving)
+                        crowded_frozen.extend(stepped_frozen)
+                        merged.append(rest)
+
+                #the merge, the crowded movers the workers left (near the
+                #edge of a band, or near a player or a stack)
+                frozen = self._frozen
+                self._frozen = {}
+                for i in numpy.unique(numpy.concatenate(merged)).tolist():
+                        if self._player[i]:
+                                if self._killed[i]:
+                                        self._remove(i)
+                        else:
+                                self._step_one(i)
+                crowded_leaving.extend(self._leaving)
+                crowded_frozen.extend(_frozen_pairs(self))
+
+                self._frozen = frozen
+                for (i, cell) in sorted(alone_frozen) + sorted(crowded_frozen):
+                        self._frozen.setdefault(cell, []).append(i)
+                self._leaving = sorted(alone_leaving) + sorted(crowded_leaving)
+                for i in self._leaving:
+                        self._lift(i, self._x.item(i), self._y.item(i))
+                        self._alive[i] = False
+                self._removed.extend(self._leaving)
+                self._leaving = []
+
+        def close(self):
+                ''' stop the workers and free the shared memory, self cannot
+                step after this
+                '''
+                if self._pool is None:
+                        return
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+                #keep the stepped state, in memory of self's own
+                for name in SHARED_ARRAYS:
+                        setattr(self, name, getattr(self, name).copy())
+                self._memory.close()
+                self._memory.unlink()
+
+# the Vector_Stage of a worker process, on the shared arrays
+_worker = None
+_worker_memory = None
+
+def _attach(memory_name, layout, width, height):
+        ''' make the worker's Vector_Stage, a view of the shared arrays '''
+        global _worker, _worker_memory
+        _worker_memory = multiprocessing.shared_memory.SharedMemory(
+                memory_name)
+        _worker = Vector_Stage.__new__(Vector_Stage)
+        for (name, dtype, shape, offset) in layout:
+                setattr(_worker, name, numpy.ndarray(
+                        shape, dtype, _worker_memory.buf, offset))
+        (_worker._width, _worker._height) = (width, height)
+        _worker._writers = numpy.zeros(_worker._kind.shape, bool)
+        _worker._leaving = []
+        _worker._frozen = {}
+
+def _sort_band(band):
+        ''' return (alone, crowded, may write), the monsters of rows
+        band[0] up to band[1] that can be stepped alone and the crowded
+        movers, as Vector_Stage.step sorts them, and the crowded monsters
+        that may change the board when stepped (writers, and those that
+        would be but for having no free cell around them, which may free
+        up)
+        '''
+        (top, bottom) = band
+        engine = _worker
+        kind = engine._kind
+        y = engine._y
+        #the movers of the band and its halo, which may be writers near the
+        #band's movers
+        near = numpy.flatnonzero(engine._alive & (y >= top - HALO) &
+                                 (y < bottom + HALO))
+        x = engine._x[near] + PAD
+        y = engine._y[near] + PAD
+        player = engine._player[near]
+
+        free = numpy.zeros(len(near), numpy.int64)
+        for (ox, oy) in _NEAR:
+                k = kind[y+oy, x+ox]
+                free += (k == EMPTY) | (k == PLAYER)
+        due = ((engine._count[near] + 1) % engine._delay[near] == 0) & \
+              ~engine._is_frozen[near]
+        infront = kind[y+engine._dy[near], x+engine._dx[near]]
+        due &= (infront == EMPTY) | (infront == MONSTER) | \
+               (infront == PLAYER) | (infront == ICE)
+        may_write = ~player & ~engine._killed[near] & due
+        writer = may_write & (free > 0)
+
+        own = (y >= top + PAD) & (y < bottom + PAD)
+        writers = engine._writers
+        (writer_x, writer_y) = (x[writer], y[writer])
+        writers[writer_y, writer_x] = True
+        (x, y, writer, may_write) = (x[own], y[own], writer[own],
+                                     may_write[own])
+        near_movers = numpy.zeros(len(x), numpy.int64)
+        near_writers = numpy.zeros(len(x), numpy.int64)
+        for (ox, oy) in _AROUND:
+                k = kind[y+oy, x+ox]
+                near_movers += (k == MONSTER) | (k == PLAYER)
+                near_writers += writers[y+oy, x+ox]
+        writers[writer_y, writer_x] = False
+
+        own = near[own]
+        crowded = (writer & (near_movers > 1)) | (near_writers > writer)
+        return (own[~crowded & ~engine._player[own]], own[crowded],
+                own[crowded & may_write])
+
+def _step_band(task):
+        ''' step the lone monsters of a band, then the crowded movers of
+        the band in clusters that nothing outside the band can reach, return
+        (the lone ones leaving, the (monster, cell) of the lone ones frozen,
+        the same for the crowded ones, the crowded movers left for the merge)
+        '''
+        (band, alone, crowded, stacked, may_write) = task
+        engine = _worker
+        engine._step_alone(alone)
+        (alone_leaving, engine._leaving) = (engine._leaving, [])
+        alone_frozen = _frozen_pairs(engine)
+
+        local = _local_movers(engine, band, crowded, stacked, may_write)
+        engine._stacks = {} #none are made, see _local_movers
+        for i in local.tolist():
+                engine._step_one(i)
+        (leaving, engine._leaving) = (engine._leaving, [])
+        return (alone_leaving, alone_frozen, leaving, _frozen_pairs(engine),
+                numpy.setdiff1d(crowded, local))
+
+def _frozen_pairs(engine):
+        ''' take the monsters frozen by engine's step, as (monster, cell) '''
+        frozen = [(i, cell) for (cell, monsters) in engine._frozen.items()
+                  for i in monsters]
+        engine._frozen = {}
+        return frozen
+
+# the offsets to half the cells within two of a cell, every pair of cells
+# that close is one of them apart one way or the other
+_HALF_AROUND = [(x, y) for (x, y) in _AROUND if (y, x) > (0, 0)]
+
+def _local_movers(engine, band, crowded, stacked, may_write):
+        ''' return, in stage order, the crowded movers in clusters that
+        stay more than HALO rows from the bands either side and hold no
+        player or stacked mover. Two crowded movers are in a cluster when
+        they are within two cells of each other and either may write, or are
+        both in a cluster with a third. What a mover does in a step only
+        depends on what has been written within a cell of it, and it only
+        writes within a cell of itself, so such a cluster can be stepped by
+        a worker on its own, and it makes no stacks.
+        '''
+        (top, bottom) = band
+        if top > 0:
+                top += HALO
+        if bottom < engine._height:
+                bottom -= HALO
+        n = len(crowded)
+        if n == 0:
+                return crowded
+        x = engine._x[crowded] + PAD
+        y = engine._y[crowded] + PAD
+        writes = numpy.isin(crowded, may_write) | numpy.isin(crowded, stacked)
+        is_crowded = numpy.zeros(len(engine._alive), bool)
+        is_crowded[crowded] = True
+        any_write = numpy.zeros(len(engine._alive), bool)
+        any_write[crowded[writes]] = True
+
+        #the pairs (as positions in crowded) in a cluster together
+        (firsts, seconds) = ([], [])
+        for (ox, oy) in _HALF_AROUND:
+                other = engine._first[y+oy, x+ox]
+                pair = (other >= 0)
+                pair[pair] = is_crowded[other[pair]]
+                pair[pair] = writes[pair] | any_write[other[pair]]
+                firsts.append(numpy.flatnonzero(pair))
+                seconds.append(numpy.searchsorted(crowded, other[pair]))
+        firsts = numpy.concatenate(firsts)
+        seconds = numpy.concatenate(seconds)
+
+        #label every cluster by its lowest position, spreading labels along
+        #the pairs and jumping to the label's label until nothing changes
+        label = numpy.arange(n)
+        while True:
+                low = numpy.minimum(label[firsts], label[seconds])
+                before = label.copy()
+                numpy.minimum.at(label, firsts, low)
+                numpy.minimum.at(label, seconds, low)
+                while True:
+                        jumped = label[label]
+                        if numpy.array_equal(jumped, label):
+                                break
+                        label = jumped
+                if numpy.array_equal(label, before):
+                        break
+
+        pinned = engine._player[crowded] | numpy.isin(crowded, stacked) | \
+                 (y < top + PAD) | (y >= bottom + PAD)
+        return crowded[~numpy.isin(label, label[pinned])]
+
+def build_stage(size, seed, monster_density=0.05, box_density=0.2):
+        ''' return a headless size x size stage of plain monsters and boxes,
+        with a player in the top left corner
+        '''
+        rng = random.Random(seed)
+        stage = Stage(size, size, 24, None, headless=True)
+        stage.set_player(KeyboardPlayer("icons/Players/player1.png", stage,
+                                        0, 0))
+        cells = rng.sample(range(1, size * size), int(
+                size * size * (monster_density + box_density)))
+        monsters = int(size * size * monster_density)
+        for n, cell in enumerate(cells):
+                (x, y) = (cell % size, cell // size)
+                if n < monsters:
+                        monster = Monster("icons/Monsters/white_monster.png",
+                                          stage, x, y, rng.randrange(1, 4))
+                        monster.set_direction(rng.choice((-1, 1)),
+                                              rng.choice((-1, 1)))
+                        stage.add_actor(monster)
+                else:
+                        stage.add_actor(Box("icons/Boxes/black_box.png",
+                                            stage, x, y))
+        return stage
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description="Time stepping a huge "
+                                         "stage on several cores.")
+        parser.add_argument("--size", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--ticks", type=int, default=20)
+        parser.add_argument("--workers", type=int, nargs="+",
+                            default=[1, os.cpu_count()])
+        args = parser.parse_args(argv)
+
+        engines = [("vector", lambda stage: Vector_Stage(stage))]
+        for workers in args.workers:
+                engines.append(("parallel", lambda stage, workers=workers:
+                                Parallel_Stage(stage, workers)))
+        for (name, make) in engines:
+                engine = make(build_stage(args.size, args.seed))
+                start = time.perf_counter()
+                for tick in range(args.ticks):
+                        engine.step()
+                elapsed = time.perf_counter() - start
+                result = {"engine": name, "size": args.size,
+                          "ticks": args.ticks,
+                          "ticks_per_second": args.ticks / elapsed,
+                          "monsters": engine.get_monster_count()}
+                if isinstance(engine, Parallel_Stage):
+                        result["workers"] = engine.get_workers()
+                        engine.close()
+                print(json.dumps(result))
+
+if __name__ == "__main__":
+        main()
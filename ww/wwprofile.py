@@ -0,0 +1,244 @@
+''' Timing where the time of a stage goes, tick by tick. A Tick_Profiler
+attached to a stage records, over a rolling window of the last ticks:
+
+        phases   how long each step took, split into stepping the movers,
+                 putting pending actors on or off the stage and publishing
+                 the changes, and how long each draw took, of which pushing
+                 it to the display (present)
+        classes  the time spent stepping the actors of each class per tick
+        get_actor  calls of Stage.get_actor per tick
+        push_depth  the length of every line of boxes walked by a push
+
+and reports each as percentiles (p50, p90, p99, max and mean):
+
+        profiler = Tick_Profiler(ww)
+        ...
+        print(profiler.format_report())
+
+Running anything with WW_PROFILE=1 in the environment profiles every stage
+it makes with one shared profiler, whose report is printed to stderr at exit
+(WW_PROFILE=file appends it to file as a JSON line instead):
+
+        WW_PROFILE=1 python wwgame.py 5
+
+A stage without a profiler pays for none of this: the timed methods are only
+put on a stage while a profiler is attached to it.
+'''
+import collections
+import json
+import multiprocessing.util
+import os
+import sys
+import time
+import weakref
+
+WINDOW = 1000 #ticks (draws, pushes) the percentiles are taken over
+
+PHASES = ["step", "movers", "pending", "publish", "draw", "present"]
+
+def percentiles(values):
+        ''' return the p50, p90, p99, max and mean of values, None when
+        there are none
+        '''
+        if not values:
+                return None
+        ordered = sorted(values)
+        last = len(ordered) - 1
+        return {"p50": ordered[last * 50 // 100],
+                "p90": ordered[last * 90 // 100],
+                "p99": ordered[last * 99 // 100],
+                "max": ordered[last],
+                "mean": sum(ordered) / float(len(ordered))}
+
+class Tick_Profiler:
+        ''' Times the phases of the steps and draws of the stages attached
+        to it, keeping the last window of each
+        '''
+
+        def __init__(self, stage=None, window=WINDOW):
+                self._window = window
+                self._phases = dict((phase, collections.deque(maxlen=window))
+                                    for phase in PHASES)
+                self._classes = {} #class name -> seconds per tick
+                self._class_steps = collections.Counter() #class name -> steps
+                self._get_actor = collections.deque(maxlen=window)
+                self._push_depth = collections.deque(maxlen=window)
+                self._ticks = 0
+
+                # what the tick being stepped has taken so far
+                self._tick_classes = collections.Counter()
+                self._tick_get_actor = 0
+                self._tick_pending = 0.0
+                self._tick_publish = 0.0
+                self._draw_present = 0.0
+
+                #stage -> the methods replaced on it, not keeping it alive
+                self._stages = weakref.WeakKeyDictionary()
+                if stage is not None:
+                        self.attach(stage)
+
+        def attach(self, stage):
+                ''' start profiling stage, by putting timed versions of its
+                step, draw and the methods they call on it
+                '''
+                step = stage.step
+                apply_pending = stage._apply_pending
+                publish_changes = stage.publish_changes
+                draw = stage.draw
+                present = stage._present
+                get_actor = stage.get_actor
+                timer = time.perf_counter
+
+                def timed_step():
+                        self._tick_classes.clear()
+                        self._tick_get_actor = 0
+                        self._tick_pending = self._tick_publish = 0.0
+                        start = timer()
+                        step()
+                        self._end_tick(timer() - start)
+
+                def timed_apply_pending():
+                        start = timer()
+                        apply_pending()
+                        self._tick_pending += timer() - start
+
+                def timed_publish_changes():
+                        start = timer()
+                        publish_changes()
+                        self._tick_publish += timer() - start
+
+                def timed_draw():
+                        self._draw_present = 0.0
+                        start = timer()
+                        draw()
+                        self._phases["draw"].append(timer() - start)
+                        self._phases["present"].append(self._draw_present)
+
+                def timed_present(rects=None):
+                        start = timer()
+                        present(rects)
+                        self._draw_present += timer() - start
+
+                def counted_get_actor(x, y):
+                        self._tick_get_actor += 1
+                        return get_actor(x, y)
+
+                methods = {"step": timed_step,
+                           "_apply_pending": timed_apply_pending,
+                           "publish_changes": timed_publish_changes,
+                           "draw": timed_draw, "_present": timed_present,
+                           "get_actor": counted_get_actor}
+                for name, method in methods.items():
+                        setattr(stage, name, method)
+                stage.set_profiler(self)
+                self._stages[stage] = list(methods)
+
+        def detach(self, stage=None):
+                ''' stop profiling stage (every stage by default), the
+                figures so far are kept
+                '''
+                for attached in list(self._stages):
+                        if stage is None or attached is stage:
+                                for name in self._stages.pop(attached):
+                                        delattr(attached, name)
+                                attached.set_profiler(None)
+
+        def step_actor(self, actor):
+                ''' step actor, timing it, called by Stage.step '''
+                start = time.perf_counter()
+                actor.step()
+                name = type(actor).__name__
+                self._tick_classes[name] += time.perf_counter() - start
+                self._class_steps[name] += 1
+
+        def count_push(self, depth):
+                ''' a line of depth boxes was walked by a push '''
+                self._push_depth.append(depth)
+
+        def _end_tick(self, elapsed):
+                phases = self._phases
+                phases["step"].append(elapsed)
+                phases["pending"].append(self._tick_pending)
+                phases["publish"].append(self._tick_publish)
+                phases["movers"].append(elapsed - self._tick_pending -
+                                        self._tick_publish)
+                for name, seconds in self._tick_classes.items():
+                        if name not in self._classes:
+                                self._classes[name] = collections.deque(
+                                        maxlen=self._window)
+                        self._classes[name].append(seconds)
+                self._get_actor.append(self._tick_get_actor)
+                self._ticks += 1
+
+        def get_ticks(self):
+                ''' return the number of steps profiled '''
+                return self._ticks
+
+        def report(self):
+                ''' return the percentiles of everything recorded over the
+                window as a dict, times in milliseconds
+                '''
+                def milliseconds(values):
+                        return percentiles([v * 1000.0 for v in values])
+
+                return {"ticks": self._ticks, "window": self._window,
+                        "phases": dict((phase, milliseconds(values))
+                                       for phase, values in
+                                       self._phases.items()),
+                        "classes": dict((name, dict(
+                                milliseconds(values),
+                                steps=self._class_steps[name]))
+                                        for name, values in
+                                        sorted(self._classes.items())),
+                        "get_actor": percentiles(self._get_actor),
+                        "push_depth": percentiles(self._push_depth)}
+
+        def format_report(self):
+                ''' return the report as a table to read '''
+                report = self.report()
+                lines = ["%d ticks, percentiles of the last %d"
+                         % (report["ticks"], report["window"]),
+                         "%-16s %10s %10s %10s %10s %10s"
+                         % ("", "p50", "p90", "p99", "max", "mean")]
+
+                def row(name, figures, unit):
+                        if figures is not None:
+                                lines.append("%-16s" % name + "".join(
+                                        " %10.3f" % figures[key] for key in
+                                        ("p50", "p90", "p99", "max", "mean"))
+                                             + " " + unit)
+
+                for phase in PHASES:
+                        row(phase, report["phases"][phase], "ms")
+                for name, figures in report["classes"].items():
+                        row(name, figures, "ms/tick")
+                row("get_actor", report["get_actor"], "calls/tick")
+                row("push_depth", report["push_depth"], "boxes")
+                return "\n".join(lines)
+
+_environment_profiler = None
+
+def environment_profiler():
+        ''' return the profiler shared by the stages profiled because of
+        WW_PROFILE, making it (and arranging for its report at exit) the
+        first time
+        '''
+        global _environment_profiler
+        if _environment_profiler is None:
+                _environment_profiler = Tick_Profiler()
+                #a finalizer rather than atexit, so worker processes (of
+                #wwbatch.py) report too
+                multiprocessing.util.Finalize(
+                        _environment_profiler, _report_at_exit,
+                        (_environment_profiler,
+                         os.environ.get("WW_PROFILE", "1")), exitpriority=0)
+        return _environment_profiler
+
+def _report_at_exit(profiler, destination):
+        if profiler.get_ticks() == 0:
+                return
+        if destination == "1":
+                sys.stderr.write(profiler.format_report() + "\n")
+        else:
+                with open(destination, "a") as output:
+                        output.write(json.dumps(profiler.report()) + "\n")
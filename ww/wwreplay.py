@@ -0,0 +1,138 @@
+''' Recording and replaying games. A Recorder sits between the game loop and
+the stage, capturing the random seed, a snapshot (see wwsnapshot.py) of the
+stage when the game starts and every player event with the step it arrived
+before, and saves them as a compact binary log:
+
+        recorder = Recorder(ww, seed)
+        ...
+        recorder.player_event(event.key)
+        recorder.step()
+        ...
+        recorder.save("game.wwr")
+
+A Replay loads the log and re-simulates it on a headless stage, as fast as
+it can. It keeps a snapshot of the stage every snapshot_interval steps, so
+stage_at(tick) only re-simulates from the nearest snapshot before tick.
+
+        python wwreplay.py game.wwr --tick 500
+'''
+import argparse
+import struct
+
+import wwsnapshot
+from ww import *
+
+MAGIC = b"WWR2"
+
+_HEADER = struct.Struct("<QI") #seed, starting snapshot length
+_TRAILER = struct.Struct("<II") #steps, events
+_EVENT = struct.Struct("<II") #step, key
+
+class Recorder:
+        ''' Records the game played on a stage, from its current state on '''
+
+        def __init__(self, stage, seed=0):
+                self._stage = stage
+                self._seed = seed
+                self._start = wwsnapshot.dump(stage)
+                self._events = [] #(step, key)
+                self._ticks = 0
+
+        def player_event(self, event):
+                ''' record event and pass it on to the stage '''
+                self._events.append((self._ticks, event))
+                self._stage.player_event(event)
+
+        def step(self):
+                self._stage.step()
+                self._ticks += 1
+
+        def get_ticks(self):
+                return self._ticks
+
+        def to_bytes(self):
+                data = [MAGIC, _HEADER.pack(self._seed, len(self._start)),
+                        self._start,
+                        _TRAILER.pack(self._ticks, len(self._events))]
+                for event in self._events:
+                        data.append(_EVENT.pack(*event))
+                return b"".join(data)
+
+        def save(self, path):
+                with open(path, "wb") as log:
+                        log.write(self.to_bytes())
+
+class Replay:
+        ''' A recorded game that can be re-simulated and sought through '''
+
+        def __init__(self, data, snapshot_interval=100):
+                if data[:len(MAGIC)] != MAGIC:
+                        raise ValueError("not a warehouse wars replay")
+                offset = len(MAGIC)
+                (self._seed, length) = _HEADER.unpack_from(data, offset)
+                offset += _HEADER.size
+                start = data[offset:offset+length]
+                offset += length
+
+                (self._ticks, event_count) = _TRAILER.unpack_from(data, offset)
+                offset += _TRAILER.size
+                self._events = {} #step -> keys pressed before it
+                for i in range(event_count):
+                        (tick, key) = _EVENT.unpack_from(data, offset)
+                        offset += _EVENT.size
+                        self._events.setdefault(tick, []).append(key)
+
+                self._snapshot_interval = snapshot_interval
+                self._snapshots = {0: start} #step -> snapshot of the stage
+
+        @classmethod
+        def load(cls, path, snapshot_interval=100):
+                with open(path, "rb") as log:
+                        return cls(log.read(), snapshot_interval)
+
+        def get_seed(self):
+                return self._seed
+
+        def get_ticks(self):
+                return self._ticks
+
+        def stage_at(self, tick):
+                ''' return a new headless stage as it was after tick steps,
+                starting from the latest snapshot at or before tick
+                '''
+                tick = min(tick, self._ticks)
+                start = max(t for t in self._snapshots if t <= tick)
+                stage = wwsnapshot.load(self._snapshots[start])
+                for t in range(start, tick):
+                        for key in self._events.get(t, ()):
+                                stage.player_event(key)
+                        stage.step()
+                        if (t+1) % self._snapshot_interval == 0 and \
+                           t+1 not in self._snapshots:
+                                self._snapshots[t+1] = wwsnapshot.dump(stage)
+                return stage
+
+        def play(self):
+                ''' return the stage at the end of the recorded game '''
+                return self.stage_at(self._ticks)
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description="Replay a recorded "
+                                         "warehouse wars game headlessly.")
+        parser.add_argument("log")
+        parser.add_argument("--tick", type=int,
+                            help="stop after this many steps")
+        args = parser.parse_args(argv)
+
+        replay = Replay.load(args.log)
+        tick = replay.get_ticks() if args.tick is None else args.tick
+        stage = replay.stage_at(tick)
+        monsters = [a for a in stage.get_actors() if isinstance(a, Monster)]
+        print("seed %d, step %d of %d: %d actors, %d monsters, game over: %s,"
+              " winner: %s" % (replay.get_seed(), min(tick,
+              replay.get_ticks()), replay.get_ticks(),
+              len(stage.get_actors()), len(monsters), stage.game_over(),
+              stage.is_winner()))
+
+if __name__ == "__main__":
+        main()
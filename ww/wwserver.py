@@ -0,0 +1,312 @@
+''' A networked warehouse wars server. The server owns the stage and steps it
+at a fixed tick rate; clients connect over TCP, each gets a Remote_Player of
+its own (any number of them, up to max_players) and sends the direction it
+wants to move in. After every step the server sends each client only what
+changed, the stage's Change_Set packed by wwsnapshot.dump_changes: actors
+that moved, appeared or went, monsters frozen or unfrozen and players that
+died.
+
+        python wwserver.py --port 7777 --seed 5
+
+Every message, both ways, is a frame: a little endian unsigned 32 bit length
+and then that many bytes. The first byte of a message from the server says
+what it is:
+
+        J  joined: player number (B), then a wwsnapshot of the stage
+        D  delta: step (I), then the changes (see wwsnapshot.dump_changes)
+        G  game over: whether the players won (B)
+
+A message from a client is one byte, a direction code, an index into
+DIRECTIONS.
+'''
+import argparse
+import asyncio
+import random
+import struct
+
+from ww import *
+import wwlevels
+import wwsnapshot
+
+TICK_RATE = 10 #steps per second
+MAX_PLAYERS = 8
+MAX_BUFFERED = 1 << 20 #bytes queued for a client before it is dropped
+
+JOINED = b"J"
+DELTA = b"D"
+GAME_OVER = b"G"
+
+_FRAME = struct.Struct("<I")
+_STEP = struct.Struct("<I")
+
+PLAYER_ICONS = ["icons/Players/player1.png", "icons/Players/player2.png"]
+
+def frame(message):
+        return _FRAME.pack(len(message)) + message
+
+async def read_frame(reader):
+        ''' return the next message from reader, None at the end '''
+        try:
+                header = await reader.readexactly(_FRAME.size)
+                return await reader.readexactly(_FRAME.unpack(header)[0])
+        except (asyncio.IncompleteReadError, ConnectionError):
+                return None
+
+class Game_Server:
+        ''' Steps a stage and keeps connected clients up to date with it '''
+
+        def __init__(self, stage, tick_rate=TICK_RATE,
+                     max_players=MAX_PLAYERS):
+                self._stage = stage
+                self._tick_length = 1.0 / tick_rate
+                self._max_players = max_players
+                self._clients = {} #player number -> stream writer
+                #clients dropped while changes were being sent, whose players
+                #leave once they have been
+                self._dropped = []
+                self._ticks = 0
+                #clients are sent a snapshot when they join, so changes
+                #made before now are never sent
+                stage.publish_changes()
+                stage.subscribe(self._changed)
+                self._subscribed = True
+                self._server = None
+                self._done = None
+
+        def get_stage(self):
+                return self._stage
+
+        def get_ticks(self):
+                return self._ticks
+
+        async def start(self, host="127.0.0.1", port=0):
+                ''' start listening, port 0 picks a free port, returns the
+                (host, port) listened on
+                '''
+                self._done = asyncio.get_running_loop().create_future()
+                self._server = await asyncio.start_server(self._serve, host,
+                                                          port)
+                return self._server.sockets[0].getsockname()[:2]
+
+        async def run(self):
+                ''' step the stage at the tick rate until the game is over,
+                waiting for the first player before starting
+                '''
+                loop = asyncio.get_running_loop()
+                while not self._clients:
+                        await asyncio.sleep(self._tick_length)
+                next_tick = loop.time()
+                while not self._stage.game_over():
+                        next_tick += self._tick_length
+                        delay = next_tick - loop.time()
+                        if delay > 0:
+                                await asyncio.sleep(delay)
+                        elif -delay > self._tick_length:
+                                #too far behind, drop the time
+                                next_tick = loop.time()
+                        self.tick()
+                self._broadcast(GAME_OVER + struct.pack(
+                        "<B", self._stage.is_winner()))
+                await self.close()
+
+        def tick(self):
+                ''' step the stage once and send the changes to every client '''
+                self._ticks += 1
+                self._stage.step()
+                self._leave_dropped()
+
+        async def close(self):
+                if self._subscribed:
+                        self._stage.unsubscribe(self._changed)
+                        self._subscribed = False
+                if self._server is not None:
+                        self._server.close()
+                        await self._server.wait_closed()
+                writers = list(self._clients.values())
+                self._clients.clear()
+                for writer in writers:
+                        writer.close()
+                await asyncio.gather(*[writer.wait_closed()
+                                       for writer in writers],
+                                     return_exceptions=True)
+                if self._done is not None and not self._done.done():
+                        self._done.set_result(None)
+
+        async def wait_closed(self):
+                await self._done
+
+        def _changed(self, stage, changes):
+                ''' send every client the changes to the stage '''
+                if self._clients:
+                        self._broadcast(DELTA + _STEP.pack(self._ticks) +
+                                        wwsnapshot.dump_changes(changes,
+                                                                stage))
+
+        def _broadcast(self, message):
+                data = frame(message)
+                for (player_number, writer) in list(self._clients.items()):
+                        if writer.transport.get_write_buffer_size() > \
+                           MAX_BUFFERED:
+                                #too slow to keep up, let it go. Its player
+                                #is removed later, a change made while the
+                                #stage publishes its changes would be lost
+                                writer.close()
+                                del self._clients[player_number]
+                                self._dropped.append(player_number)
+                                continue
+                        writer.write(data)
+
+        def _leave_dropped(self):
+                ''' remove the players of the clients dropped and tell the
+                others, which may drop more
+                '''
+                while self._dropped:
+                        for player_number in self._dropped:
+                                self._leave(player_number)
+                        self._dropped = []
+                        self._stage.publish_changes()
+
+        def _free_slot(self):
+                for player_number in range(1, self._max_players + 1):
+                        if player_number not in self._clients and \
+                           self._stage.get_player(player_number) is None:
+                                return player_number
+                return None
+
+        def _spawn_cell(self):
+                ''' the first empty cell, reading from the top left corner '''
+                for y in range(self._stage.get_height()):
+                        for x in range(self._stage.get_width()):
+                                if self._stage.get_actor(x, y) is None:
+                                        return (x, y)
+                return None
+
+        def _join(self, writer):
+                ''' give a new client a player, return its number or None
+                when there is no room
+                '''
+                player_number = self._free_slot()
+                cell = self._spawn_cell()
+                if player_number is None or cell is None:
+                        return None
+                icon = PLAYER_ICONS[(player_number-1) % len(PLAYER_ICONS)]
+                player = Remote_Player(icon, self._stage, cell[0], cell[1],
+                                       player_number)
+                self._stage.add_player(player)
+                #tell the others about the new player before joining them
+                self._stage.publish_changes()
+                self._leave_dropped()
+                self._clients[player_number] = writer
+                writer.write(frame(JOINED + struct.pack("<B", player_number)
+                                   + wwsnapshot.dump(self._stage)))
+                return player_number
+
+        def _leave(self, player_number):
+                self._clients.pop(player_number, None)
+                player = self._stage.get_player(player_number)
+                if player is not None:
+                        self._stage.remove_player(player)
+
+        async def _serve(self, reader, writer):
+                player_number = self._join(writer)
+                if player_number is None:
+                        writer.close()
+                        return
+                try:
+                        while True:
+                                message = await read_frame(reader)
+                                if message is None:
+                                        break
+                                player = self._stage.get_player(player_number)
+                                if player is None: #died
+                                        continue
+                                for code in message:
+                                        player.handle_event(code)
+                except ConnectionError:
+                        pass
+                finally:
+                        if self._clients.get(player_number) is writer:
+                                self._leave(player_number)
+                        writer.close()
+
+class Game_Client:
+        ''' A connection to a Game_Server, for bots and tests '''
+
+        def __init__(self, reader, writer):
+                self._reader = reader
+                self._writer = writer
+                self._player_number = None
+                self._stage = None
+
+        @classmethod
+        async def connect(cls, host, port):
+                ''' connect and wait until joined, None when the server is
+                full
+                '''
+                (reader, writer) = await asyncio.open_connection(host, port)
+                client = cls(reader, writer)
+                message = await read_frame(reader)
+                if message is None or message[:1] != JOINED:
+                        writer.close()
+                        return None
+                client._player_number = message[1]
+                client._stage = wwsnapshot.load(message[2:])
+                return client
+
+        def get_player_number(self):
+                return self._player_number
+
+        def get_stage(self):
+                ''' a headless copy of the server's stage, kept up to date by
+                read_message
+                '''
+                return self._stage
+
+        def send_direction(self, code):
+                self._writer.write(frame(struct.pack("<B", code)))
+
+        async def read_message(self):
+                ''' return the next message from the server as (kind, data),
+                making the changes in a delta to self's stage. For a delta
+                data is its step, for game over it is whether the players
+                won. None at the end
+                '''
+                message = await read_frame(self._reader)
+                if message is None:
+                        return None
+                kind = message[:1]
+                if kind == GAME_OVER:
+                        return (kind, bool(message[1]))
+                if kind != DELTA:
+                        return (kind, message[1:])
+                (step,) = _STEP.unpack_from(message, 1)
+                wwsnapshot.apply_changes(self._stage,
+                                         memoryview(message)[1+_STEP.size:])
+                return (kind, step)
+
+        async def close(self):
+                self._writer.close()
+                await self._writer.wait_closed()
+
+async def serve(host, port, seed, tick_rate, max_players):
+        stage = Stage(20, 20, 24, None, headless=True)
+        wwlevels.classic_level(stage, 0, random.Random(seed))
+        server = Game_Server(stage, tick_rate, max_players)
+        (host, port) = await server.start(host, port)
+        print("serving on %s:%d" % (host, port))
+        await server.run()
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description="Run a warehouse wars "
+                                         "server.")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=7777)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--tick-rate", type=float, default=TICK_RATE)
+        parser.add_argument("--max-players", type=int, default=MAX_PLAYERS)
+        args = parser.parse_args(argv)
+        asyncio.run(serve(args.host, args.port, args.seed, args.tick_rate,
+                          args.max_players))
+
+if __name__ == "__main__":
+        main()
@@ -0,0 +1,295 @@
+''' Saving and restoring the state of a stage. dump(stage) packs everything
+the simulation needs into a compact binary snapshot: every actor's class,
+id, icon, position, delay and delay count, dead and frozen flags, monster
+directions, players' numbers and last keys (or directions), which monsters
+are frozen to which Ice_Box, and the stage's counts of evolutions and player
+deaths. load(data) rebuilds a stage from it, with the same ids, so the
+restored stage steps exactly as the saved one would have. It puts every
+actor on the stage as Stage.add_actor does, about 12 microseconds an actor
+(a second for a 500x500 board of 80,000 actors), so a big stage is better
+copied with its part of interest only (see dump's actors).
+
+        data = dump(ww)
+        copy = load(data) #headless, for simulating
+        save_file(ww, "game.wws")
+        ww = load_file("game.wws", load_icon("icons/Screens/stage.png"))
+
+Snapshots are taken between steps, never during one.
+
+dump_changes(changes, stage) packs a stage's Change_Set into a much smaller
+delta, and apply_changes(copy, delta) makes the same changes to a copy of
+the stage, so a copy can follow the original a step at a time.
+'''
+import mmap
+import struct
+
+from ww import *
+
+MAGIC = b"WWS2"
+
+# the actor classes a snapshot can hold, a class is stored as its index here,
+# so new classes go on the end
+ACTOR_CLASSES = [Actor, Player, KeyboardPlayer, Box, Ice_Box, Wall,
+                 Fire_Wall, Monster, Shy_Monster, Stalker_Monster,
+                 Fire_Monster, Earth_Monster, Ice_Monster, Remote_Player]
+
+_CLASS_NUMBERS = dict((cls, n) for n, cls in enumerate(ACTOR_CLASSES))
+
+#width, height, icon dimension, field radius, next id, colour, colour
+#change, evolutions, player deaths, icons, actors, ice boxes with frozen
+#monsters
+_HEADER = struct.Struct("<HHHHIBbIIIII")
+#id, class, icon, x, y, delay, delay count, flags, player number, dx, dy,
+#disguise icon, last key
+_ACTOR = struct.Struct("<IBHhhHHBBbbHI")
+_ICON_LENGTH = struct.Struct("<H")
+_FROZEN = struct.Struct("<II") #ice box id, frozen monsters
+
+#moves, icons, spawned actors, removed actors, freezes, player deaths
+_CHANGES = struct.Struct("<IIIIII")
+_MOVE = struct.Struct("<Ihhhh") #id, old x, old y, new x, new y
+_FREEZE = struct.Struct("<IB") #monster id, frozen
+
+#actor flags
+DEAD = 1
+FROZEN = 2
+LAST_EVENT = 4 #the last key field holds a key
+
+def register_actor_class(cls):
+        ''' let snapshots hold actors of cls, which must take the arguments
+        of one of the classes already registered
+        '''
+        if cls not in _CLASS_NUMBERS:
+                _CLASS_NUMBERS[cls] = len(ACTOR_CLASSES)
+                ACTOR_CLASSES.append(cls)
+        return cls
+
+def _pack_actors(actors, stage, only=False):
+        ''' return (icon table, actor records, frozen lists) for actors, only
+        keeping frozen monsters that are among actors when only is true
+        '''
+        if only:
+                packed = set(a.get_id() for a in actors)
+        icons = {} #icon file -> number
+
+        def icon_number(icon_file):
+                if icon_file not in icons:
+                        icons[icon_file] = len(icons)
+                return icons[icon_file]
+
+        records = []
+        frozen = []
+        for a in actors:
+                flags = player_number = dx = dy = disguise = last_event = 0
+                #not a.is_dead(), which kills (and evolves) boxed in
+                #monsters, a snapshot must not change the stage
+                if Actor.is_dead(a):
+                        flags |= DEAD
+                if isinstance(a, Player):
+                        player_number = a.get_player_number()
+                if isinstance(a, KeyboardPlayer) and \
+                   a.get_last_event() is not None:
+                        flags |= LAST_EVENT
+                        last_event = a.get_last_event()
+                if isinstance(a, Remote_Player) and \
+                   a.get_direction() is not None:
+                        flags |= LAST_EVENT
+                        last_event = a.get_direction()
+                if isinstance(a, Monster):
+                        (dx, dy) = a.get_direction()
+                        if a.is_frozen():
+                                flags |= FROZEN
+                if isinstance(a, Shy_Monster):
+                        disguise = icon_number(a.get_disguise_file())
+                if isinstance(a, Ice_Box):
+                        monsters = [m.get_id() for m in a.get_frozen_monsters()
+                                    if stage.has_actor(m) and
+                                    (not only or m.get_id() in packed)]
+                        if monsters:
+                                frozen.append((a.get_id(), monsters))
+                (x, y) = a.get_position()
+                records.append(_ACTOR.pack(a.get_id(), _CLASS_NUMBERS[type(a)],
+                                           icon_number(a.get_icon_file()),
+                                           x, y, a.get_delay(),
+                                           a.get_delay_count(), flags,
+                                           player_number, dx, dy, disguise,
+                                           last_event))
+
+        table = []
+        for icon_file in sorted(icons, key=icons.get):
+                name = icon_file.encode("utf-8")
+                table.append(_ICON_LENGTH.pack(len(name)) + name)
+        return (table, records, frozen)
+
+def _unpack_icons(data, offset, count):
+        ''' return (icon files, offset after them) '''
+        icons = []
+        for i in range(count):
+                (length,) = _ICON_LENGTH.unpack_from(data, offset)
+                offset += _ICON_LENGTH.size
+                icons.append(bytes(data[offset:offset+length]).decode("utf-8"))
+                offset += length
+        return (icons, offset)
+
+def _add_actor(stage, record, icons):
+        ''' build the actor of an unpacked record and put it on stage, with
+        its id, return it
+        '''
+        (actor_id, cls, icon, x, y, delay, delay_count, flags,
+         player_number, dx, dy, disguise, last_event) = record
+        cls = ACTOR_CLASSES[cls]
+        if issubclass(cls, Player):
+                actor = cls(icons[icon], stage, x, y, player_number)
+        elif issubclass(cls, Shy_Monster):
+                actor = cls(icons[icon], icons[disguise], stage, x, y, delay)
+        else:
+                actor = cls(icons[icon], stage, x, y, delay)
+        actor.set_delay_count(delay_count)
+        if flags & DEAD:
+                actor.kill()
+        if flags & LAST_EVENT:
+                actor.handle_event(last_event)
+        if isinstance(actor, Monster):
+                actor.set_direction(dx, dy)
+                actor.set_frozen(bool(flags & FROZEN))
+        next_id = stage.get_next_id()
+        stage.set_next_id(actor_id)
+        if isinstance(actor, Player):
+                stage.add_player(actor)
+        else:
+                stage.add_actor(actor)
+        stage.set_next_id(max(next_id, actor_id + 1))
+        return actor
+
+def dump(stage, actors=None):
+        ''' return the state of stage as bytes, with only actors (part of
+        the actors of stage, in stage order) on it when given
+        '''
+        if actors is None:
+                (icons, records, frozen) = _pack_actors(stage.get_actors(),
+                                                        stage)
+        else:
+                (icons, records, frozen) = _pack_actors(actors, stage, True)
+        data = [MAGIC, _HEADER.pack(stage.get_width(), stage.get_height(),
+                                    stage.get_icon_dimension(),
+                                    stage.get_field_radius(),
+                                    stage.get_next_id(), stage.get_colour(),
+                                    stage.get_colour_change(),
+                                    stage.get_evolution_count(),
+                                    stage.get_player_death_count(),
+                                    len(icons), len(records), len(frozen))]
+        data.extend(icons)
+        data.extend(records)
+        for (ice_id, monsters) in frozen:
+                data.append(_FROZEN.pack(ice_id, len(monsters)))
+                data.append(struct.pack("<%dI" % len(monsters), *monsters))
+        return b"".join(data)
+
+def load(data, pic=None, headless=True, surface=None):
+        ''' return a new stage with the state dumped into data (any buffer),
+        headless unless told otherwise, when pic is its background picture
+        '''
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+                raise ValueError("not a warehouse wars snapshot")
+        offset = len(MAGIC)
+        (width, height, icon_dimension, field_radius, next_id, colour,
+         colour_change, evolutions, player_deaths, icon_count, actor_count,
+         frozen_count) = _HEADER.unpack_from(data, offset)
+        offset += _HEADER.size
+        stage = Stage(width, height, icon_dimension, pic, colour,
+                      colour_change, headless, surface, field_radius)
+        (icons, offset) = _unpack_icons(data, offset, icon_count)
+
+        actors = {}
+        for record in _ACTOR.iter_unpack(
+                        data[offset:offset + actor_count*_ACTOR.size]):
+                actors[record[0]] = _add_actor(stage, record, icons)
+        offset += actor_count*_ACTOR.size
+
+        for i in range(frozen_count):
+                (ice_id, count) = _FROZEN.unpack_from(data, offset)
+                offset += _FROZEN.size
+                for monster_id in struct.unpack_from("<%dI" % count, data,
+                                                     offset):
+                        actors[ice_id].add_to_frozen(actors[monster_id])
+                offset += 4*count
+
+        stage.set_next_id(next_id)
+        stage.set_counts(evolutions, player_deaths)
+        return stage
+
+def dump_changes(changes, stage):
+        ''' return the Change_Set changes of stage as a compact delta '''
+        moved = changes.get_moved()
+        spawned = [a for a in changes.get_spawned() if stage.has_actor(a)]
+        removed = changes.get_removed()
+        frozen = changes.get_frozen()
+        died = changes.get_died()
+        (icons, records, ignored) = _pack_actors(spawned, stage)
+        return b"".join([_CHANGES.pack(len(moved) // 5, len(icons),
+                                       len(records), len(removed),
+                                       len(frozen) // 2, len(died)),
+                         struct.pack("<" + "Ihhhh" * (len(moved) // 5),
+                                     *moved)]
+                        + icons + records
+                        + [struct.pack("<%dI" % len(removed), *removed),
+                           struct.pack("<" + "IB" * (len(frozen) // 2),
+                                       *frozen),
+                           struct.pack("<%dB" % len(died), *died)])
+
+def apply_changes(stage, data):
+        ''' make the changes in the delta data to stage, a copy of the stage
+        they were dumped from, to follow it (for drawing, not simulating:
+        which Ice_Box froze a monster is not sent)
+        '''
+        (move_count, icon_count, spawn_count, remove_count, frozen_count,
+         died_count) = _CHANGES.unpack_from(data, 0)
+        offset = _CHANGES.size
+
+        (icons, start) = _unpack_icons(data, offset + move_count*_MOVE.size,
+                                       icon_count)
+        for record in _ACTOR.iter_unpack(
+                        data[start:start + spawn_count*_ACTOR.size]):
+                if stage.get_actor_by_id(record[0]) is None:
+                        _add_actor(stage, record, icons)
+
+        for (actor_id, old_x, old_y, x, y) in _MOVE.iter_unpack(
+                        data[offset:offset + move_count*_MOVE.size]):
+                actor = stage.get_actor_by_id(actor_id)
+                if actor is not None:
+                        actor.set_position(x, y)
+        offset = start + spawn_count*_ACTOR.size
+
+        removed = struct.unpack_from("<%dI" % remove_count, data, offset)
+        offset += 4*remove_count
+        for i in range(frozen_count):
+                (monster_id, frozen_bool) = _FREEZE.unpack_from(data, offset)
+                offset += _FREEZE.size
+                monster = stage.get_actor_by_id(monster_id)
+                if monster is not None:
+                        monster.set_frozen(bool(frozen_bool))
+        for player_number in struct.unpack_from("<%dB" % died_count, data,
+                                                offset):
+                player = stage.get_player(player_number)
+                if player is not None:
+                        player.kill()
+                        stage.remove_player(player)
+        for actor_id in removed:
+                actor = stage.get_actor_by_id(actor_id)
+                if isinstance(actor, Player):
+                        stage.remove_player(actor) #left the game
+                elif actor is not None:
+                        stage.remove_actor(actor)
+        stage.publish_changes()
+
+def save_file(stage, path):
+        with open(path, "wb") as snapshot:
+                snapshot.write(dump(stage))
+
+def load_file(path, pic=None, headless=True, surface=None):
+        ''' load the snapshot saved at path, reading it through a memory map
+        '''
+        with open(path, "rb") as snapshot:
+                with mmap.mmap(snapshot.fileno(), 0,
+                               access=mmap.ACCESS_READ) as data:
+                        return load(data, pic, headless, surface)
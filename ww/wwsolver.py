@@ -0,0 +1,424 @@
+''' Finding out whether the monsters of a stage can be got rid of, and how.
+A Solver searches breadth first over the moves of one player (any of the
+eight DIRECTIONS or waiting a step), stepping a copy of the stage after each
+move, for the shortest sequence of moves after which a monster is gone from
+the stage (trapped, or led into fire):
+
+        solver = Solver(ww)
+        for solution in solver.solve():
+                print(solution["monster"], solution["moves"],
+                      solution["pushes"])
+
+        python wwsolver.py --seed 5 --depth 10
+        python wwsolver.py --snapshot game.wws
+
+The states searched are wwsnapshot snapshots of the part of the stage around
+the player and the monster (margin cells on every side of both, enough that
+nothing further away can reach them within the steps searched, except along
+a long line of pushed boxes), so the size of the whole stage does not matter.
+When a Stalker_Monster is among them the margin grows by the field radius,
+as the boxes that far away change the distance field it steers by.
+Each state is known by a Zobrist hash: a 64 bit key for every actor's id and
+cell, one for every monster's direction, frozen flag and delay count less
+the steps taken (which stays the same while the monster counts down), and
+one for how far the steps taken are through each monster delay, XORed
+together. A step only updates the keys of the actors its Change_Set says
+moved, appeared or went, and of the monsters that turned, froze, thawed or
+missed a count, found by comparing the monsters before and after it (they
+turn in too many places for a Change_Set to say). Hashes of the
+states seen go in a Transposition_Table of a fixed size, so a state reached
+again by another sequence of moves is not searched twice. The search gives
+up on a monster at max_depth moves, or when the states waiting to be
+searched would take more than memory_budget bytes.
+'''
+import argparse
+import array
+import json
+import random
+
+from ww import *
+import wwlevels
+import wwsnapshot
+
+MAX_DEPTH = 12 #most moves searched
+TABLE_SIZE = 1 << 20 #slots of a transposition table, a power of two
+MEMORY_BUDGET = 256 << 20 #bytes of states and tables a search may keep
+
+WAIT = len(DIRECTIONS) #the move code of waiting, ignored by Remote_Player
+MOVES = list(range(len(DIRECTIONS))) + [WAIT]
+
+_MASK = (1 << 64) - 1
+_CLOCK = -1 #in the place of an id in the keys of the clock
+
+def zobrist_key(*numbers):
+        ''' return the random looking 64 bit key of numbers, splitmix64 of
+        each in turn, worked out when asked for rather than kept in tables,
+        so any stage size (and any number of ids) has keys
+        '''
+        key = 0
+        for n in numbers:
+                z = (key ^ (n & _MASK)) + 0x9E3779B97F4A7C15 & _MASK
+                z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9 & _MASK
+                z = (z ^ (z >> 27)) * 0x94D049BB133111EB & _MASK
+                key = z ^ (z >> 31)
+        return key
+
+def position_key(actor_id, x, y):
+        return zobrist_key(actor_id, x, y)
+
+def monster_state(monster, step=0):
+        ''' return the state of monster other than where it is, step steps
+        into a search: its direction, its delay count less step (the same
+        after a step unless it missed a count) and whether it is frozen
+        '''
+        (dx, dy) = monster.get_direction()
+        return (dx, dy, (monster.get_delay_count() - step) %
+                monster.get_delay(), 2 + monster.is_frozen())
+
+def monster_key(monster, step=0):
+        return zobrist_key(monster.get_id(), *monster_state(monster, step))
+
+def clock_key(delays, step):
+        ''' return the key of how far step is through each of the (distinct)
+        delays, which with the monsters' keys tells their delay counts apart
+        '''
+        key = 0
+        for delay in delays:
+                key ^= zobrist_key(_CLOCK, delay, step % delay)
+        return key
+
+def position_hash(stage):
+        ''' return the XOR of the position keys of every actor on stage '''
+        key = 0
+        for a in stage.get_actors():
+                (x, y) = a.get_position()
+                key ^= position_key(a.get_id(), x, y)
+        return key
+
+def monster_hash(stage, step=0):
+        ''' return the XOR of the keys of every monster on stage and of the
+        clock, step steps into a search
+        '''
+        key = 0
+        delays = set()
+        for a in stage.get_actors():
+                if isinstance(a, Monster):
+                        key ^= monster_key(a, step)
+                        delays.add(a.get_delay())
+        return key ^ clock_key(delays, step)
+
+class Transposition_Table:
+        ''' The hashes of the states a search has seen, in a fixed number of
+        slots. A hash goes in the slot picked by its low bits, replacing the
+        one there, so the table never grows: it forgets, and a forgotten
+        state is only searched again.
+        '''
+
+        def __init__(self, size=TABLE_SIZE):
+                if size & (size - 1):
+                        raise ValueError("table size must be a power of two")
+                self._slots = array.array("Q", bytes(8 * size))
+                self._mask = size - 1
+                self._hits = 0
+                self._replaced = 0
+
+        def visit(self, key):
+                ''' return whether key is in self, putting it in if not '''
+                key = key or 1 #0 marks an empty slot
+                i = key & self._mask
+                slot = self._slots[i]
+                if slot == key:
+                        self._hits += 1
+                        return True
+                if slot:
+                        self._replaced += 1
+                self._slots[i] = key
+                return False
+
+        def get_size_bytes(self):
+                return self._slots.itemsize * len(self._slots)
+
+        def get_hits(self):
+                return self._hits
+
+        def get_replaced(self):
+                return self._replaced
+
+class Solver:
+        ''' Searches for the shortest sequence of moves of one player that
+        gets rid of each monster of a stage (the stage itself is never
+        changed)
+        '''
+
+        def __init__(self, stage, player_number=1, max_depth=MAX_DEPTH,
+                     margin=None, table_size=TABLE_SIZE,
+                     memory_budget=MEMORY_BUDGET):
+                self._stage = stage
+                self._player_number = player_number
+                self._max_depth = max_depth
+                #cells kept around the player and the monster, far enough
+                #that nothing outside reaches them within max_depth steps
+                self._margin = max_depth + 2 if margin is None else margin
+                self._table_size = table_size
+                self._memory_budget = memory_budget
+                self._states = 0 #states stepped, over every search
+
+        def get_states(self):
+                return self._states
+
+        def solve(self):
+                ''' return a solution (see solve_monster) for every monster on
+                the stage, in stage order
+                '''
+                return [self.solve_monster(a) for a in self._stage.get_actors()
+                        if isinstance(a, Monster)]
+
+        def solve_monster(self, monster):
+                ''' search for the shortest sequence of moves after which
+                monster is off the stage, return a dict of the monster's id,
+                class and cell and the moves found (direction codes, WAIT for
+                a step without moving) with the boxes pushed along the way,
+                or moves None and why the search gave up: "depth" (nothing
+                within max_depth moves), "memory" (over memory_budget) or
+                "player" (no player to move)
+                '''
+                (x, y) = monster.get_position()
+                solution = {"monster": monster.get_id(),
+                            "class": type(monster).__name__,
+                            "position": [x, y], "moves": None,
+                            "pushes": None, "states": 0}
+                root = self._window(monster)
+                if root is None:
+                        solution["reason"] = "player"
+                        return solution
+                (moves, reason, states) = self._search(root,
+                                                       monster.get_id())
+                solution["states"] = states
+                if moves is None:
+                        solution["reason"] = reason
+                else:
+                        solution["moves"] = moves
+                        solution["pushes"] = self._count_pushes(root, moves)
+                return solution
+
+        def _window(self, monster):
+                ''' return a headless copy of the part of the stage around the
+                player and monster, with its players turned into
+                Remote_Players to move by direction code, None when the
+                player is not on the stage
+                '''
+                player = self._stage.get_player(self._player_number)
+                if player is None or player.is_dead():
+                        return None
+                actors = self._actors_around(player, monster, self._margin)
+                if any(isinstance(a, Stalker_Monster) for a in actors):
+                        #a Stalker_Monster steers by the distance field, which
+                        #goes around boxes as far as the field radius from
+                        #the players (and the players move, as may the
+                        #Stalker_Monster before it gets there)
+                        actors = self._actors_around(
+                                player, monster, 2*self._margin +
+                                self._stage.get_field_radius())
+                actors.sort(key=Actor.get_id)
+                copy = wwsnapshot.load(wwsnapshot.dump(self._stage, actors))
+                for player in copy.get_players():
+                        if not isinstance(player, Remote_Player):
+                                self._make_remote(copy, player)
+                copy.publish_changes()
+                return copy
+
+        def _actors_around(self, player, monster, margin):
+                ''' return the actors within margin cells of the box around
+                player and monster
+                '''
+                (px, py) = player.get_position()
+                (mx, my) = monster.get_position()
+                return self._stage.get_actors_in(
+                        min(px, mx) - margin, min(py, my) - margin,
+                        abs(px - mx) + 2*margin + 1,
+                        abs(py - my) + 2*margin + 1)
+
+        def _make_remote(self, stage, player):
+                ''' replace player by a Remote_Player with its id and cell '''
+                (x, y) = player.get_position()
+                remote = Remote_Player(player.get_icon_file(), stage, x, y,
+                                       player.get_player_number())
+                if player.is_dead():
+                        remote.kill()
+                stage.remove_player(player)
+                next_id = stage.get_next_id()
+                stage.set_next_id(player.get_id())
+                stage.add_player(remote)
+                stage.set_next_id(next_id)
+
+        def _search(self, root, monster_id):
+                ''' breadth first search from root, return (moves, reason it
+                gave up, states stepped)
+                '''
+                table = Transposition_Table(self._table_size)
+                root_hash = position_hash(root) ^ monster_hash(root)
+                table.visit(root_hash)
+                #each state searched is (snapshot, hash, node), a node being
+                #the index of the move that reached it in parents and moves,
+                #so the sequence can be read back from the last
+                parents = array.array("i")
+                moves = bytearray()
+                frontier = [(wwsnapshot.dump(root), root_hash, -1)]
+                frontier_bytes = len(frontier[0][0])
+                states = 0
+                for depth in range(self._max_depth):
+                        next_frontier = []
+                        next_bytes = 0
+                        for (data, parent_hash, node) in frontier:
+                                for code in MOVES:
+                                        stage = wwsnapshot.load(data)
+                                        key = self._step(stage, code,
+                                                         parent_hash, depth)
+                                        states += 1
+                                        self._states += 1
+                                        if stage.get_player(
+                                                self._player_number) is None:
+                                                continue #died
+                                        if stage.get_actor_by_id(
+                                                monster_id) is None:
+                                                return (self._moves(
+                                                        parents, moves, node)
+                                                        + [code], None, states)
+                                        if table.visit(key):
+                                                continue
+                                        child = wwsnapshot.dump(stage)
+                                        next_bytes += len(child)
+                                        if frontier_bytes + next_bytes + \
+                                           table.get_size_bytes() + \
+                                           5 * len(moves) > \
+                                           self._memory_budget:
+                                                return (None, "memory",
+                                                        states)
+                                        parents.append(node)
+                                        moves.append(code)
+                                        next_frontier.append(
+                                                (child, key, len(moves) - 1))
+                        if not next_frontier:
+                                break
+                        (frontier, frontier_bytes) = (next_frontier,
+                                                      next_bytes)
+                return (None, "depth", states)
+
+        def _step(self, stage, code, key, step):
+                ''' move the player of stage, step steps into the search, by
+                code and step it, return the hash after, worked out from key
+                (the hash before) and what the step changed
+                '''
+                actors = dict((a.get_id(), a) for a in stage.get_actors())
+                (monsters, delays) = self._monster_states(stage, step)
+                stage.publish_changes() #loading it is not a change
+                stage.get_player(self._player_number).handle_event(code)
+                hashes = []
+                stage.subscribe(lambda stage, changes: hashes.append(
+                        self._hash_changes(changes, actors, key)))
+                stage.step()
+
+                (after, after_delays) = self._monster_states(stage, step + 1)
+                key = hashes[0] ^ clock_key(delays, step) ^ \
+                      clock_key(after_delays, step + 1)
+                for (monster_id, state) in monsters.items():
+                        if after.get(monster_id) != state:
+                                key ^= zobrist_key(monster_id, *state)
+                for (monster_id, state) in after.items():
+                        if monsters.get(monster_id) != state:
+                                key ^= zobrist_key(monster_id, *state)
+                return key
+
+        def _monster_states(self, stage, step):
+                ''' return the monster_state of every monster of stage by id
+                and the set of their delays
+                '''
+                states = {}
+                delays = set()
+                for a in stage.get_actors():
+                        if isinstance(a, Monster):
+                                states[a.get_id()] = monster_state(a, step)
+                                delays.add(a.get_delay())
+                return (states, delays)
+
+        def _hash_changes(self, changes, actors, key):
+                ''' return key updated for the moves, new actors and actors
+                gone of the Change_Set changes, with actors the actors before
+                they were made
+                '''
+                moved = changes.get_moved()
+                for i in range(0, len(moved), 5):
+                        actor_id = moved[i]
+                        key ^= position_key(actor_id, moved[i+1], moved[i+2]) \
+                               ^ position_key(actor_id, moved[i+3], moved[i+4])
+                for a in changes.get_spawned():
+                        (x, y) = a.get_position()
+                        key ^= position_key(a.get_id(), x, y)
+                        actors[a.get_id()] = a
+                for actor_id in changes.get_removed():
+                        (x, y) = actors[actor_id].get_position()
+                        key ^= position_key(actor_id, x, y)
+                return key
+
+        def _moves(self, parents, moves, node):
+                ''' return the moves leading to node '''
+                sequence = []
+                while node != -1:
+                        sequence.append(moves[node])
+                        node = parents[node]
+                sequence.reverse()
+                return sequence
+
+        def _count_pushes(self, root, moves):
+                ''' return the number of moves of moves that push boxes,
+                playing them again on a copy of root
+                '''
+                stage = wwsnapshot.load(wwsnapshot.dump(root))
+                stage.publish_changes()
+                pushes = [0]
+
+                def count(stage, changes):
+                        moved = changes.get_moved()
+                        for i in range(0, len(moved), 5):
+                                if isinstance(stage.get_actor_by_id(
+                                        moved[i]), Box):
+                                        pushes[0] += 1
+                                        return
+
+                stage.subscribe(count)
+                for code in moves:
+                        stage.get_player(self._player_number).handle_event(
+                                code)
+                        stage.step()
+                return pushes[0]
+
+def main(argv=None):
+        parser = argparse.ArgumentParser(description="Find the shortest "
+                                         "ways to get rid of the monsters "
+                                         "of a warehouse wars level.")
+        parser.add_argument("--snapshot", help="solve this saved stage")
+        parser.add_argument("--seed", type=int, default=0,
+                            help="else solve the classic level of this seed")
+        parser.add_argument("--player", type=int, default=1)
+        parser.add_argument("--depth", type=int, default=MAX_DEPTH,
+                            help="most moves searched")
+        parser.add_argument("--margin", type=int,
+                            help="cells kept around the player and monster "
+                                 "(default: depth + 2)")
+        parser.add_argument("--table-size", type=int, default=TABLE_SIZE)
+        parser.add_argument("--memory", type=int, default=MEMORY_BUDGET >> 20,
+                            help="memory budget in megabytes")
+        args = parser.parse_args(argv)
+
+        if args.snapshot is not None:
+                stage = wwsnapshot.load_file(args.snapshot)
+        else:
+                stage = Stage(20, 20, 24, None, headless=True)
+                wwlevels.classic_level(stage, 1, random.Random(args.seed))
+        solver = Solver(stage, args.player, args.depth, args.margin,
+                        args.table_size, args.memory << 20)
+        for solution in solver.solve():
+                print(json.dumps(solution))
+
+if __name__ == "__main__":
+        main()
@@ -0,0 +1,385 @@
+''' An optional NumPy engine for boards whose only moving actors are plain
+Monsters (boxes, walls, fire walls, ice boxes and idle players may be on the
+board too). The board is kept as arrays, a cell type grid plus position,
+direction and delay arrays for the monsters, and every tick the monsters are
+stepped together in one vectorized pass. A monster only changes the board
+when it moves, freezes or is removed, so only movers within two cells of
+such a change can affect each other. Those few are stepped one at a time, in
+stage order, exactly like Monster.step would, and the results are the same
+as Stage.step on the object model.
+
+        engine = Vector_Stage(stage)
+        for tick in range(1000):
+                engine.step()
+        engine.sync() # write positions, deaths, ... back to the stage
+'''
+try:
+        import numpy
+except ImportError: # numpy is only needed for this engine
+        numpy = None
+
+from ww import *
+
+# cell types, the type of the first actor at a cell
+EMPTY, BOX, WALL, FIRE, ICE, MONSTER, PLAYER, OUT = range(8)
+
+# the board is padded by PAD cells of OUT on every side so neighbourhoods
+# can be read without bounds checks
+PAD = 2
+
+# offsets of the 3x3 neighbourhood (checked by Monster.is_dead) and of the
+# 5x5 one (the cells a monster can read or write in a tick, seen from another
+# monster)
+_NEAR = [(x, y) for x in range(-1, 2) for y in range(-1, 2)]
+_AROUND = [(x, y) for x in range(-2, 3) for y in range(-2, 3)]
+
+def _cell_type(actor):
+        ''' return the cell type of a non-moving actor '''
+        if isinstance(actor, Fire_Wall):
+                return FIRE
+        if isinstance(actor, Wall):
+                return WALL
+        if isinstance(actor, Ice_Box):
+                return ICE
+        if isinstance(actor, Box):
+                return BOX
+        raise ValueError("unsupported actor for Vector_Stage: %s"
+                         % type(actor).__name__)
+
+class Vector_Stage:
+        ''' A copy of a stage's state as NumPy arrays that can be stepped in
+        bulk. Monsters and players are 'movers', kept in stage order.
+        '''
+
+        def __init__(self, stage):
+                if numpy is None:
+                        raise ImportError("Vector_Stage needs numpy")
+                self._stage = stage
+                width, height = stage.get_width(), stage.get_height()
+                self._width, self._height = width, height
+
+                self._kind = numpy.full((height + 2*PAD, width + 2*PAD), OUT,
+                                        numpy.uint8)
+                self._kind[PAD:-PAD, PAD:-PAD] = EMPTY
+                #index of the first mover at each cell, -1 if there is none
+                self._first = numpy.full(self._kind.shape, -1, numpy.int64)
+                self._writers = numpy.zeros(self._kind.shape, bool) #scratch
+                #cells holding more than one mover -> movers in stage order
+                self._stacks = {}
+
+                self._movers = [] #the actor objects, in stage order
+                self._ices = {} #cell -> Ice_Box
+                self._frozen = {} #cell -> movers frozen onto that Ice_Box
+
+                statics = {}
+                for a in stage.get_actors():
+                        if type(a) is Monster or isinstance(a, Player):
+                                self._movers.append(a)
+                                continue
+                        if a.is_dead():
+                                raise ValueError("Vector_Stage cannot load "
+                                                 "dead boxes")
+                        cell = a.get_position()
+                        if cell in statics:
+                                raise ValueError("Vector_Stage cannot load "
+                                                 "stacked boxes at %s"
+                                                 % (cell,))
+                        statics[cell] = _cell_type(a)
+                        if statics[cell] == ICE:
+                                self._ices[cell] = a
+
+                for (x, y), kind in statics.items():
+                        self._kind[y+PAD, x+PAD] = kind
+
+                n = len(self._movers)
+                self._player = numpy.zeros(n, bool)
+                self._x = numpy.zeros(n, numpy.int64)
+                self._y = numpy.zeros(n, numpy.int64)
+                self._dx = numpy.zeros(n, numpy.int64)
+                self._dy = numpy.zeros(n, numpy.int64)
+                self._delay = numpy.ones(n, numpy.int64)
+                self._count = numpy.zeros(n, numpy.int64)
+                self._is_frozen = numpy.zeros(n, bool)
+                self._killed = numpy.zeros(n, bool)
+                self._alive = numpy.ones(n, bool) #still on the stage
+                self._leaving = [] #movers to take off at the end of the step
+                self._removed = [] #movers taken off since the last sync
+
+                for i, a in enumerate(self._movers):
+                        self._x[i], self._y[i] = a.get_position()
+                        self._killed[i] = a.is_dead() if isinstance(
+                                a, Player) else Actor.is_dead(a)
+                        if isinstance(a, Player):
+                                self._player[i] = True
+                        else:
+                                self._dx[i], self._dy[i] = a.get_direction()
+                                self._delay[i] = a.get_delay()
+                                self._count[i] = a.get_delay_count()
+                                self._is_frozen[i] = a.is_frozen()
+                        if (a.get_position() in statics):
+                                raise ValueError("Vector_Stage cannot load "
+                                                 "a mover on a box at %s"
+                                                 % (a.get_position(),))
+                        self._place(i, int(self._x[i]), int(self._y[i]))
+
+        def get_stage(self):
+                return self._stage
+
+        def get_monster_count(self):
+                return int((self._alive & ~self._player).sum())
+
+        def get_player_count(self):
+                return int((self._alive & self._player).sum())
+
+        def get_monsters(self):
+                ''' return (x, y, dx, dy) arrays of the monsters still on the
+                stage, in stage order
+                '''
+                live = self._alive & ~self._player
+                return (self._x[live], self._y[live], self._dx[live],
+                        self._dy[live])
+
+        def _code(self, i):
+                if self._player[i]:
+                        return PLAYER
+                return MONSTER
+
+        def _place(self, i, x, y):
+                ''' put mover i at (x, y), keeping stacked movers in order '''
+                (px, py) = (x + PAD, y + PAD)
+                first = self._first.item(py, px)
+                if first == -1:
+                        self._first[py, px] = i
+                        self._kind[py, px] = self._code(i)
+                        return
+                movers = self._stacks.get((x, y))
+                if movers is None:
+                        movers = [first]
+                        self._stacks[(x, y)] = movers
+                movers.append(i)
+                movers.sort()
+                self._first[py, px] = movers[0]
+                self._kind[py, px] = self._code(movers[0])
+
+        def _lift(self, i, x, y):
+                ''' take mover i off (x, y) '''
+                (px, py) = (x + PAD, y + PAD)
+                movers = self._stacks.get((x, y))
+                if movers is None:
+                        self._first[py, px] = -1
+                        self._kind[py, px] = EMPTY
+                        return
+                movers.remove(i)
+                self._first[py, px] = movers[0]
+                self._kind[py, px] = self._code(movers[0])
+                if len(movers) == 1:
+                        del self._stacks[(x, y)]
+
+        def _remove(self, i):
+                ''' take mover i off the board at the end of the step '''
+                self._leaving.append(i)
+
+        def game_over(self):
+                ''' the same test as Stage.game_over '''
+                return self.get_player_count() == 0 or \
+                       self.get_monster_count() == 0
+
+        def step(self):
+                ''' step every mover once, like Stage.step '''
+                kind = self._kind
+                live = numpy.flatnonzero(self._alive)
+                x = self._x[live] + PAD
+                y = self._y[live] + PAD
+                player = self._player[live]
+
+                #'writers' may change the board this tick: living monsters
+                #that are due to move somewhere other than a box. Another
+                #mover within two cells of a writer may see the change, so
+                #both are stepped one by one. Everything else is independent.
+                free = numpy.zeros(len(live), numpy.int64)
+                for (ox, oy) in _NEAR:
+                        k = kind[y+oy, x+ox]
+                        free += (k == EMPTY) | (k == PLAYER)
+                due = ((self._count[live] + 1) % self._delay[live] == 0) & \
+                      ~self._is_frozen[live]
+                infront = kind[y+self._dy[live], x+self._dx[live]]
+                due &= (infront == EMPTY) | (infront == MONSTER) | \
+                       (infront == PLAYER) | (infront == ICE)
+                writer = ~player & ~self._killed[live] & (free > 0) & due
+
+                movers = (kind == MONSTER) | (kind == PLAYER)
+                writers = self._writers
+                writers[y[writer], x[writer]] = True
+                near_movers = numpy.zeros(len(live), numpy.int64)
+                near_writers = numpy.zeros(len(live), numpy.int64)
+                for (ox, oy) in _AROUND:
+                        near_movers += movers[y+oy, x+ox]
+                        near_writers += writers[y+oy, x+ox]
+                writers[y[writer], x[writer]] = False
+
+                crowded = (writer & (near_movers > 1)) | \
+                          (near_writers > writer)
+                for cell in self._stacks:
+                        for i in self._stacks[cell]:
+                                crowded[numpy.searchsorted(live, i)] = True
+
+                self._step_alone(live[~crowded & ~player])
+
+                #players only act here by being removed once dead, a player
+                #far from every writer cannot be killed during the step
+                for i in live[crowded | (player & self._killed[live])].tolist():
+                        if self._player[i]:
+                                if self._killed[i]:
+                                        self._remove(i)
+                        else:
+                                self._step_one(i)
+
+                #the end of Stage.step, dead movers leave the board
+                for i in self._leaving:
+                        self._lift(i, self._x.item(i), self._y.item(i))
+                        self._alive[i] = False
+                self._removed.extend(self._leaving)
+                self._leaving = []
+
+        def _step_alone(self, idx):
+                ''' step the monsters idx, none of which can reach another
+                mover this tick, all at once
+                '''
+                if len(idx) == 0:
+                        return
+                kind = self._kind
+                x, y = self._x[idx], self._y[idx]
+                dx, dy = self._dx[idx], self._dy[idx]
+
+                #Monster.is_dead, no free cell (empty or player) around,
+                #dead monsters are removed and do nothing else
+                free = numpy.zeros(len(idx), numpy.int64)
+                for (ox, oy) in _NEAR:
+                        k = kind[y+oy+PAD, x+ox+PAD]
+                        free += (k == EMPTY) | (k == PLAYER)
+                dead = self._killed[idx] | (free == 0)
+                self._killed[idx] = dead
+                self._leaving.extend(idx[dead].tolist())
+
+                count = numpy.where(dead, self._count[idx],
+                                    (self._count[idx] + 1) % self._delay[idx])
+                self._count[idx] = count
+                act = ~dead & (count == 0) & ~self._is_frozen[idx]
+
+                #Monster.move, reflect off the edges first
+                new_x, new_y = x + dx, y + dy
+                out_x = act & ((new_x < 0) | (new_x >= self._width))
+                out_y = act & ((new_y < 0) | (new_y >= self._height))
+                dx = numpy.where(out_x, -dx, dx)
+                dy = numpy.where(out_y, -dy, dy)
+                bounce = out_x | out_y
+
+                infront = numpy.where(act, kind[new_y+PAD, new_x+PAD], EMPTY)
+                ice = infront == ICE
+                fire = infront == FIRE
+                blocked = act & ((infront == BOX) | (infront == WALL) |
+                                 (infront == MONSTER))
+                dx = numpy.where(blocked, -dx, dx)
+                dy = numpy.where(blocked, -dy, dy)
+                moved = act & (infront == EMPTY) & ~bounce
+
+                self._dx[idx], self._dy[idx] = dx, dy
+                self._killed[idx] |= fire
+                self._is_frozen[idx] |= ice
+                for i, cell in zip(idx[ice].tolist(),
+                                   zip(new_x[ice].tolist(),
+                                       new_y[ice].tolist())):
+                        self._frozen.setdefault(cell, []).append(i)
+
+                go = idx[moved]
+                kind[y[moved]+PAD, x[moved]+PAD] = EMPTY
+                self._first[y[moved]+PAD, x[moved]+PAD] = -1
+                kind[new_y[moved]+PAD, new_x[moved]+PAD] = MONSTER
+                self._first[new_y[moved]+PAD, new_x[moved]+PAD] = go
+                self._x[go], self._y[go] = new_x[moved], new_y[moved]
+
+        def _step_one(self, i):
+                ''' Monster.step for the single monster i, reading the arrays
+                one item at a time
+                '''
+                kind = self._kind
+                x, y = self._x.item(i), self._y.item(i)
+
+                #Actor.step, removing the monster if it is surrounded
+                if not self._killed.item(i):
+                        for (ox, oy) in _NEAR:
+                                if kind.item(y+oy+PAD, x+ox+PAD) in (EMPTY,
+                                                                     PLAYER):
+                                        break
+                        else:
+                                self._killed[i] = True
+                if self._killed.item(i):
+                        self._remove(i)
+                        return
+
+                count = (self._count.item(i) + 1) % self._delay.item(i)
+                self._count[i] = count
+                if count != 0 or self._is_frozen.item(i):
+                        return
+
+                #Monster.move
+                dx, dy = self._dx.item(i), self._dy.item(i)
+                new_x, new_y = x + dx, y + dy
+                bounce = False
+                if not 0 <= new_x < self._width:
+                        self._dx[i] = -dx
+                        bounce = True
+                if not 0 <= new_y < self._height:
+                        self._dy[i] = -dy
+                        bounce = True
+
+                infront = kind.item(new_y+PAD, new_x+PAD)
+                if infront == ICE:
+                        self._frozen.setdefault((new_x, new_y), []).append(i)
+                        self._is_frozen[i] = True
+                        return
+                if infront == FIRE:
+                        self._killed[i] = True
+                        return
+                if infront in (BOX, WALL, MONSTER):
+                        self._dx[i] = -self._dx.item(i)
+                        self._dy[i] = -self._dy.item(i)
+                        bounce = True
+                if infront == PLAYER:
+                        self._killed[self._first.item(new_y+PAD,
+                                                      new_x+PAD)] = True
+                if bounce:
+                        return
+
+                self._lift(i, x, y)
+                self._place(i, new_x, new_y)
+                self._x[i], self._y[i] = new_x, new_y
+
+        def sync(self):
+                ''' write the engine's state back to the stage's actors '''
+                stage = self._stage
+                for i, a in enumerate(self._movers):
+                        if self._killed[i] and not a.is_dead():
+                                a.kill()
+                        if self._player[i]:
+                                continue
+                        a.set_direction(int(self._dx[i]), int(self._dy[i]))
+                        a.set_delay_count(int(self._count[i]))
+                        a.set_frozen(bool(self._is_frozen[i]))
+                        if self._alive[i]:
+                                a.set_position(int(self._x[i]),
+                                               int(self._y[i]))
+
+                for i in self._removed:
+                        a = self._movers[i]
+                        if isinstance(a, Player):
+                                stage.remove_player(a)
+                        else:
+                                stage.remove_actor(a)
+                self._removed = []
+
+                for cell, frozen in self._frozen.items():
+                        for i in frozen:
+                                self._ices[cell].add_to_frozen(
+                                        self._movers[i])
+                self._frozen = {}